@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Measure the sustained throughput of ControlServer: a client process sends positions for
+several sources over the loopback interface as fast as possible while VbapPlayer plays
+in real time through the offline backend. Reports the positions sent and received per
+second, the batches of position updates applied to the player and the callback times of
+the player, to check that the control traffic doesn't disturb the audio thread.
+"""
+
+import argparse
+import functools
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from control_server import ControlClient, ControlServer, DEFAULT_HOST
+from pan_to_file import LS_FORMATS
+from vbap_player import OfflineStream, VbapPlayer
+
+
+def send(port, source_ids, per_datagram, duration, result):
+    """
+    Send positions of the given sources for duration seconds, per_datagram positions in
+    each datagram, and put the number of positions sent into the result queue.
+    """
+    n_sent = 0
+    i = 0
+    with ControlClient(DEFAULT_HOST, port) as client:
+        t_end = time.perf_counter() + duration
+        while time.perf_counter() < t_end:
+            ids = [source_ids[(i + k) % len(source_ids)] for k in range(per_datagram)]
+            az = [(i * 0.1) % 360 - 180] * per_datagram
+            client.send_positions(ids, az, [0] * per_datagram)
+            n_sent += per_datagram
+            i += per_datagram
+    result.put(n_sent)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--ls_setup", default="5d0+4", choices=LS_FORMATS)
+    parser.add_argument("-n", "--n_sources", type=int, default=16)
+    parser.add_argument(
+        "-k", "--per_datagram", type=int, default=1, help="Positions per datagram"
+    )
+    parser.add_argument("-d", "--duration", type=float, default=5)
+    parser.add_argument("-b", "--blocksize", type=int, default=256)
+    parser.add_argument("-r", "--samplerate", type=int, default=48000)
+    args = parser.parse_args()
+
+    ls_pos = LS_FORMATS[args.ls_setup]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "noise.wav")
+        noise = np.random.default_rng(0).uniform(-0.1, 0.1, args.samplerate)
+        sf.write(filename, noise, args.samplerate)
+
+        player = VbapPlayer(
+            ls_pos["azimuth"],
+            ls_pos["elevation"],
+            filename,
+            bufsize=args.blocksize,
+            backend=functools.partial(OfflineStream, realtime=True),
+            samplerate=args.samplerate,
+        )
+        source_ids = [0] + [
+            player.add_source(filename) for _ in range(args.n_sources - 1)
+        ]
+
+        server = ControlServer(player, port=0)
+        server.start()
+        player.play()
+
+        result = multiprocessing.Queue()
+        client = multiprocessing.Process(
+            target=send,
+            args=(server.port, source_ids, args.per_datagram, args.duration, result),
+        )
+        client.start()
+        n_sent = result.get()
+        client.join()
+        # let the server apply the last batch
+        time.sleep(10 * server.interval)
+
+        server.stop()
+        player.stop()
+        stats = player._stream.stats()
+
+    print(
+        f"{args.ls_setup}, {args.n_sources} sources, {args.per_datagram} positions per "
+        f"datagram, blocksize {args.blocksize}"
+    )
+    print(f"sent:     {n_sent / args.duration:12.0f} positions/s")
+    print(
+        f"received: {server.n_messages / args.duration:12.0f} positions/s "
+        f"({100 * (1 - server.n_messages / max(n_sent, 1)):.1f}% lost)"
+    )
+    print(
+        f"applied:  {server.n_batches / args.duration:12.1f} batches/s "
+        f"(at most {1 / server.interval:.1f})"
+    )
+    print(
+        f"callback: p50 {stats['p50'] * 1e3:.3f} ms, p99 {stats['p99'] * 1e3:.3f} ms, "
+        f"max {stats['max'] * 1e3:.3f} ms, {stats['deadline_misses']} deadline misses, "
+        f"{player.underruns} underruns"
+    )
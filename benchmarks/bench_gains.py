@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for gain computation and file rendering over the built-in
+loudspeaker setups and generated large domes, with random source directions.
+Results can be saved as json and compared against a saved baseline, in which
+case the script exits with status 1 if any benchmark got slower than allowed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pan_to_file import LS_FORMATS, pan_to_file
+from pyvbap import VbapPanner
+from pyvbap.vbap_panner import ang_to_cart
+
+# Width in degrees of the spread sources
+SPREAD = 30
+
+# ITU-R BS.2051 system H without the LFE channels, bottom, middle and upper layer
+SETUP_22D2 = {
+    "azimuth": [0, 45, -45]
+    + [0, 30, -30, 60, -60, 90, -90, 135, -135, 180]
+    + [0, 45, -45, 90, -90, 135, -135, 180, 0],
+    "elevation": [-30] * 3 + [0] * 10 + [45] * 8 + [90],
+}
+
+
+def dome(n_ls: int) -> dict:
+    """
+    Loudspeaker dome with n_ls speakers: a ring at ear height and the rest
+    spread evenly over the upper hemisphere (Fibonacci lattice).
+    """
+    n_ring = max(4, round(2 * np.sqrt(n_ls)))
+    ring_az = np.arange(n_ring) * 360 / n_ring - 180
+    i = np.arange(n_ls - n_ring)
+    el = np.degrees(np.arcsin((i + 0.5) / len(i)))
+    az = (np.degrees(i * np.pi * (3 - np.sqrt(5))) + 180) % 360 - 180
+    return {
+        "azimuth": np.concatenate([ring_az, az]).round(3).tolist(),
+        "elevation": np.concatenate([np.zeros(n_ring), el]).round(3).tolist(),
+    }
+
+
+def layouts() -> dict:
+    setups = dict(LS_FORMATS)
+    setups["22.2"] = SETUP_22D2
+    setups["dome50"] = dome(50)
+    setups["dome200"] = dome(200)
+    return setups
+
+
+def random_directions(n: int, is_2d: bool, seed: int = 0) -> tuple:
+    """
+    Directions uniformly distributed over the circle (2-D) or the upper
+    hemisphere (3-D).
+    """
+    rng = np.random.default_rng(seed)
+    az = rng.uniform(-180, 180, n)
+    if is_2d:
+        return az, np.zeros(n)
+    return az, np.degrees(np.arcsin(rng.uniform(0, 1, n)))
+
+
+def time_per_call(func, min_time: float) -> float:
+    """
+    Best time per call in seconds out of 3 repetitions, each running func
+    often enough to take at least min_time.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(3, number)) / number
+
+
+def run_benchmarks(setup: dict, n_dirs: int, min_time: float, tmp_dir: str) -> dict:
+    """
+    Run all benchmarks for one loudspeaker setup, returns seconds per
+    operation by benchmark name.
+    """
+    ls_az, ls_el = setup["azimuth"], setup["elevation"]
+    results = {}
+
+    results["init"] = time_per_call(lambda: VbapPanner(ls_az, ls_el), min_time)
+
+    panners = {lookup: VbapPanner(ls_az, ls_el, lookup) for lookup in ("scan", "walk")}
+    is_2d = panners["scan"].is_2d
+    az, el = random_directions(n_dirs, is_2d)
+    dirs = list(zip(az.tolist(), el.tolist()))
+
+    def loop(func):
+        def run():
+            for a, e in dirs:
+                func(a, e)
+
+        return run
+
+    for lookup, panner in panners.items():
+        results[f"calc_gains[{lookup}]"] = (
+            time_per_call(loop(panner.calc_gains), min_time) / n_dirs
+        )
+    results["find_active_triangle"] = (
+        time_per_call(loop(panners["scan"].find_active_triangle), min_time) / n_dirs
+    )
+    results["calc_gains_batch"] = (
+        time_per_call(lambda: panners["scan"].calc_gains_batch(az, el), min_time)
+        / n_dirs
+    )
+    results["calc_gains[spread]"] = (
+        time_per_call(
+            loop(lambda a, e: panners["scan"].calc_gains(a, e, spread=SPREAD)),
+            min_time,
+        )
+        / n_dirs
+    )
+    results["calc_gains_batch[spread]"] = (
+        time_per_call(
+            lambda: panners["scan"].calc_gains_batch(az, el, SPREAD), min_time
+        )
+        / n_dirs
+    )
+    results["ang_to_cart"] = (
+        time_per_call(loop(lambda a, e: ang_to_cart(a, e, is_2d)), min_time) / n_dirs
+    )
+    results["ang_to_cart[batch]"] = (
+        time_per_call(lambda: ang_to_cart(az, el, is_2d), min_time) / n_dirs
+    )
+
+    infile = os.path.join(tmp_dir, "in.wav")
+    outfile = os.path.join(tmp_dir, "out.wav")
+    n_frames = sf.info(infile).frames
+    results["pan_to_file"] = (
+        time_per_call(
+            lambda: pan_to_file(infile, outfile, setup, az[0], el[0]), min_time
+        )
+        / n_frames
+    )
+    return results
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--ls_setups",
+        nargs="+",
+        default=list(layouts()),
+        choices=list(layouts()),
+        help="Loudspeaker setups to benchmark",
+    )
+    parser.add_argument(
+        "-n", "--n_dirs", type=int, default=1000, help="Random source directions"
+    )
+    parser.add_argument(
+        "-t",
+        "--min_time",
+        type=float,
+        default=0.2,
+        help="Minimum time in seconds per measurement",
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=10, help="Seconds of audio rendered"
+    )
+    parser.add_argument("-o", "--outfile", help="Save results to this json file")
+    parser.add_argument(
+        "-c", "--compare", help="Compare with results saved in this json file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.2,
+        help="Max. allowed slowdown factor when comparing",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    all_results = {}
+    n_slower = 0
+    setups = layouts()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        samplerate = 48000
+        noise = np.random.default_rng(0).uniform(
+            -0.1, 0.1, int(args.duration * samplerate)
+        )
+        sf.write(os.path.join(tmp_dir, "in.wav"), noise, samplerate)
+
+        print(f"{'setup':<10} {'benchmark':<24} {'time per op':>12}  op")
+        for name in args.ls_setups:
+            results = run_benchmarks(setups[name], args.n_dirs, args.min_time, tmp_dir)
+            all_results[name] = results
+            for bench, seconds in results.items():
+                unit = "frame" if bench == "pan_to_file" else "direction"
+                if bench == "init":
+                    unit = "panner"
+                line = f"{name:<10} {bench:<24} {format_time(seconds):>12}  {unit}"
+
+                old = baseline.get(name, {}).get(bench)
+                if old is not None:
+                    ratio = seconds / old
+                    line += f"  {ratio:.2f}x baseline"
+                    if ratio > args.tolerance:
+                        line += "  SLOWER"
+                        n_slower += 1
+                print(line)
+
+    if args.outfile:
+        with open(args.outfile, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+    if n_slower > 0:
+        print(f"{n_slower} benchmarks slower than {args.tolerance}x baseline")
+        sys.exit(1)
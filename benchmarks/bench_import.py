@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Measure the cold start time of pyvbap in fresh interpreters, i.e. what a
+short-lived batch job pays before it can calculate its first gains.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP_3D = (
+    "[30, 0, -30, 110, -110, 45, -45, 135, -135], [0, 0, 0, 0, 0, 45, 45, 45, 45]"
+)
+
+SCENARIOS = {
+    "import pyvbap": "import pyvbap",
+    "import pyvbap + scipy.spatial (eager import)": "import pyvbap, scipy.spatial",
+    "2-D panner": "import pyvbap; pyvbap.VbapPanner([30, 0, -30, 110, -110])",
+    "3-D panner, no cache": f"import pyvbap; pyvbap.VbapPanner({SETUP_3D})",
+    "3-D panner, warm cache": f"import pyvbap; pyvbap.VbapPanner({SETUP_3D}, cache=True)",
+}
+
+
+def time_snippet(code: str, runs: int, env: dict) -> tuple:
+    """
+    Run code in fresh interpreters and return the median wall time in
+    milliseconds and whether scipy got imported.
+    """
+    script = (
+        "import time, sys; t = time.perf_counter()\n"
+        f"{code}\n"
+        "print((time.perf_counter() - t) * 1000, 'scipy' in sys.modules)"
+    )
+    times = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=REPO_DIR,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        times.append(float(out[0]))
+    return statistics.median(times), out[1] == "True"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--runs", type=int, default=10, help="Interpreter starts per scenario"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, PYVBAP_CACHE_DIR=cache_dir)
+        # populate the cache for the warm cache scenario
+        time_snippet(SCENARIOS["3-D panner, warm cache"], 1, env)
+
+        print(f"{'scenario':<46} {'median [ms]':>12}  scipy imported")
+        for name, code in SCENARIOS.items():
+            median, has_scipy = time_snippet(code, args.runs, env)
+            print(f"{name:<46} {median:>12.1f}  {has_scipy}")
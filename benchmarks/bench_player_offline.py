@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Render VbapPlayer through the offline backend, without a sound card, and report the
+callback time percentiles and deadline misses for a range of block sizes. A deadline
+miss is a callback that takes longer than its block lasts. Exits with status 1 if
+more than --max_misses callbacks missed their deadline, so it can run in CI.
+"""
+
+import argparse
+import functools
+import os
+import sys
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pan_to_file import LS_FORMATS
+from vbap_player import MemorySink, OfflineStream, VbapPlayer
+
+
+def run(filename, ls_pos, blocksize, samplerate, n_sources, n_blocks, realtime):
+    """
+    Play n_sources sources for n_blocks blocks, moving the first source every block.
+    Returns the stats of the offline stream and the number of underruns.
+    """
+    sink = MemorySink(samplerate, len(ls_pos["azimuth"]))
+    backend = functools.partial(OfflineStream, realtime=realtime, sink=sink)
+    player = VbapPlayer(
+        ls_pos["azimuth"],
+        ls_pos["elevation"],
+        filename,
+        bufsize=blocksize,
+        backend=backend,
+        samplerate=samplerate,
+    )
+    for _ in range(n_sources - 1):
+        player.add_source(filename)
+
+    stream = player._stream
+    for i in range(n_blocks):
+        player.set_position((i * 3) % 360 - 180, 0)
+        stream.run(1)
+
+    stats = stream.stats()
+    underruns = player.underruns
+    del player
+    return stats, underruns
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-b", "--blocksizes", type=int, nargs="+", default=[32, 64, 128, 256, 512, 1024]
+    )
+    parser.add_argument("-r", "--samplerate", type=int, default=48000)
+    parser.add_argument("-s", "--ls_setup", default="5d0+4", choices=LS_FORMATS)
+    parser.add_argument("-n", "--n_sources", type=int, default=8)
+    parser.add_argument("-N", "--n_blocks", type=int, default=1000)
+    parser.add_argument(
+        "-t",
+        "--realtime",
+        action="store_true",
+        help="Pace callbacks at the rate of a sound card instead of as fast as possible",
+    )
+    parser.add_argument("-m", "--max_misses", type=int, default=0)
+    args = parser.parse_args()
+
+    ls_pos = LS_FORMATS[args.ls_setup]
+    print(
+        f"{args.ls_setup}, {args.n_sources} sources, "
+        f"{'real time' if args.realtime else 'as fast as possible'}"
+    )
+    print(
+        f"{'blocksize':>10} {'budget [ms]':>12} {'p50 [ms]':>9} {'p90 [ms]':>9} "
+        f"{'p99 [ms]':>9} {'max [ms]':>9} {'misses':>7} {'underruns':>10}"
+    )
+
+    total_misses = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "noise.wav")
+        noise = np.random.default_rng(0).uniform(-0.1, 0.1, args.samplerate)
+        sf.write(filename, noise, args.samplerate)
+
+        for blocksize in args.blocksizes:
+            stats, underruns = run(
+                filename,
+                ls_pos,
+                blocksize,
+                args.samplerate,
+                args.n_sources,
+                args.n_blocks,
+                args.realtime,
+            )
+            total_misses += stats["deadline_misses"]
+            print(
+                f"{blocksize:>10} {stats['budget'] * 1e3:>12.3f} "
+                f"{stats['p50'] * 1e3:>9.3f} {stats['p90'] * 1e3:>9.3f} "
+                f"{stats['p99'] * 1e3:>9.3f} {stats['max'] * 1e3:>9.3f} "
+                f"{stats['deadline_misses']:>7} {underruns:>10}"
+            )
+
+    if total_misses > args.max_misses:
+        print(f"{total_misses} deadline misses, at most {args.max_misses} allowed")
+        sys.exit(1)
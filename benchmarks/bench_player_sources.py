@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Find the maximum number of moving sources VbapPlayer can mix in real time. The audio
+callback is called directly at the rate a sound card would call it, while all sources
+are moved every block. A source count is real-time capable if the 99th percentile of
+the callback time stays within the block duration. Position updates run on the control
+thread, their cost is reported separately.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pan_to_file import LS_FORMATS
+from vbap_player import OfflineStream, VbapPlayer
+
+
+def run(player, n_blocks, blocksize, samplerate, n_src):
+    """
+    Call the audio callback in real time, moving all sources before every block.
+    Returns the times of the position updates and of the callbacks in seconds.
+    """
+    outdata = np.zeros((blocksize, len(player._panner.ls_az)), dtype=np.float32)
+    ids = list(player._sources)
+    budget = blocksize / samplerate
+    update_times = np.empty(n_blocks)
+    callback_times = np.empty(n_blocks)
+    deadline = time.perf_counter()
+
+    for i in range(n_blocks):
+        t_start = time.perf_counter()
+        az = (np.arange(n_src) * 360 / n_src + i) % 360 - 180
+        player.set_positions(ids, az, np.zeros(n_src) + (i % 45))
+        t_update = time.perf_counter()
+        player._audio_callback(outdata, blocksize, None, None)
+        t_callback = time.perf_counter()
+
+        update_times[i] = t_update - t_start
+        callback_times[i] = t_callback - t_update
+
+        deadline += budget
+        time.sleep(max(0, deadline - time.perf_counter()))
+
+    return update_times, callback_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-b", "--blocksize", type=int, default=128)
+    parser.add_argument("-r", "--samplerate", type=int, default=48000)
+    parser.add_argument("-s", "--ls_setup", default="5d0+4", choices=LS_FORMATS)
+    parser.add_argument("-n", "--n_blocks", type=int, default=500)
+    parser.add_argument("-m", "--max_sources", type=int, default=512)
+    args = parser.parse_args()
+
+    ls_pos = LS_FORMATS[args.ls_setup]
+    budget = args.blocksize / args.samplerate
+    print(
+        f"{args.ls_setup}, blocksize {args.blocksize}, "
+        f"budget per block {budget * 1e3:.2f} ms"
+    )
+    print(
+        f"{'sources':>8} {'update [ms]':>12} {'callback [ms]':>14} "
+        f"{'p99 [ms]':>10} {'load':>6} {'underruns':>10}"
+    )
+
+    max_sources = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "noise.wav")
+        noise = np.random.default_rng(0).uniform(-0.1, 0.1, args.samplerate)
+        sf.write(filename, noise, args.samplerate)
+
+        n_src = 1
+        while n_src <= args.max_sources:
+            player = VbapPlayer(
+                ls_pos["azimuth"],
+                ls_pos["elevation"],
+                bufsize=args.blocksize,
+                backend=OfflineStream,
+            )
+            for _ in range(n_src):
+                player.add_source(filename)
+
+            update_times, times = run(
+                player, args.n_blocks, args.blocksize, args.samplerate, n_src
+            )
+            p99 = np.percentile(times, 99)
+            load = (times.mean() + update_times.mean()) / budget
+            print(
+                f"{n_src:>8} {update_times.mean() * 1e3:>12.3f} "
+                f"{times.mean() * 1e3:>14.3f} {p99 * 1e3:>10.3f} "
+                f"{load:>6.0%} {player.underruns:>10}"
+            )
+            del player
+
+            if p99 > budget:
+                break
+            max_sources = n_src
+            n_src *= 2
+
+    print(f"Max. number of moving sources in real time: {max_sources}")
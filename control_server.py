@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Network control of VbapPlayer: an asyncio UDP server that receives source positions as
+JSON datagrams and a client for sending them.
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+from threading import Thread, Event
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9000
+# bytes of datagrams the operating system keeps until the server reads them
+RECEIVE_BUFFER_SIZE = 1 << 20
+
+
+class ControlServer:
+    """
+    Receives source positions as JSON over UDP and moves the sources of a VbapPlayer. Every
+    datagram holds one position or a list of positions, each an object like
+
+        {"source": 1, "azimuth": 30, "elevation": 10}
+
+    where elevation defaults to 0. Positions are not applied one by one: only the latest
+    position of each source is kept, and all sources that moved are passed to
+    VbapPlayer.set_positions in one batch once per interval, by default once per block of
+    the player. Bursts of messages thus cost one batch gain calculation per block, which
+    runs in a worker thread, so the server keeps receiving in the meantime. The audio
+    callback never waits for the server.
+
+    Can be run in an existing event loop with serve, or in a background thread with start
+    and stop.
+    """
+
+    def __init__(
+        self,
+        player,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        interval: float = None,
+    ):
+        """
+        port: UDP port to listen on, 0 picks a free port, see self.port after starting
+        interval: seconds between batches of position updates, defaults to the duration
+            of one block of the player
+        """
+        self.player = player
+        self.host = host
+        self.port = port
+        if interval is None:
+            interval = player.bufsize / player.samplerate
+        self.interval = interval
+
+        # number of received positions, of position batches passed to the player and of
+        # invalid messages, invalid positions and positions of unknown sources
+        self.n_messages = 0
+        self.n_batches = 0
+        self.n_errors = 0
+
+        # latest position of each source since the last batch, by source id
+        self._pending = dict()
+        self._stopped = None
+        self._loop = None
+        self._thread = None
+        self._ready = None
+        self._error = None
+
+    async def serve(self):
+        """
+        Receive and apply positions until stop is called.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _ControlProtocol(self), local_addr=(self.host, self.port)
+        )
+        self.port = transport.get_extra_info("sockname")[1]
+        # room for bursts of datagrams while a batch is being applied
+        sock = transport.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        if self._ready is not None:
+            self._ready.set()
+
+        try:
+            while not self._stopped.is_set():
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                await self._apply_pending()
+        finally:
+            transport.close()
+
+    def start(self):
+        """
+        Run the server in its own event loop in a background thread, returns once the
+        server is listening.
+        """
+        self._ready = Event()
+        self._error = None
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            self._thread = None
+            raise self._error
+
+    def stop(self):
+        if self._loop is not None and self._stopped is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                # the loop has already finished
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            # e.g. the port is in use, raised again by start
+            self._error = e
+        finally:
+            self._ready.set()
+
+    def receive(self, data: bytes):
+        """
+        Parse one datagram and keep its positions until the next batch.
+        """
+        try:
+            msg = json.loads(data)
+            for pos in msg if isinstance(msg, list) else [msg]:
+                az = float(pos["azimuth"])
+                el = float(pos.get("elevation", 0))
+                # a newer position of the same source replaces the pending one
+                self._pending[int(pos["source"])] = (az, el)
+                self.n_messages += 1
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.n_errors += 1
+
+    async def _apply_pending(self):
+        if len(self._pending) == 0:
+            return
+        pending = self._pending
+        self._pending = dict()
+
+        source_ids = list(pending)
+        azimuths = [pending[i][0] for i in source_ids]
+        elevations = [pending[i][1] for i in source_ids]
+
+        # positions of unknown sources or invalid positions are skipped by the player,
+        # the others applied
+        try:
+            skipped = await self._loop.run_in_executor(
+                None, self.player.set_positions, source_ids, azimuths, elevations
+            )
+        except Exception:
+            # a bad batch must not stop the server, it keeps serving the next ones
+            self.n_errors += len(source_ids)
+            return
+        self.n_errors += len(skipped)
+        if len(skipped) == len(source_ids):
+            return
+        self.n_batches += 1
+        if self.player.stats is not None:
+            self.player.stats.count("control_batches")
+            self.player.stats.count("control_messages", len(source_ids) - len(skipped))
+
+
+class _ControlProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.receive(data)
+
+
+class ControlClient:
+    """
+    Sends source positions to a ControlServer.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.address = (host, port)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send_position(self, source_id: int, azimuth: float, elevation: float = 0):
+        self.send_positions([source_id], [azimuth], [elevation])
+
+    def send_positions(self, source_ids: list, azimuths: list, elevations: list):
+        """
+        Send the positions of several sources in one datagram.
+        """
+        msg = [
+            {"source": i, "azimuth": az, "elevation": el}
+            for i, az, el in zip(source_ids, azimuths, elevations)
+        ]
+        self._sock.sendto(json.dumps(msg).encode(), self.address)
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Send a source position to a running ControlServer"
+    )
+    parser.add_argument("source", type=int, help="Id of the source to move")
+    parser.add_argument("azimuth", type=float)
+    parser.add_argument("elevation", type=float, nargs="?", default=0)
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST)
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    with ControlClient(args.host, args.port) as client:
+        client.send_position(args.source, args.azimuth, args.elevation)
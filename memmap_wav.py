@@ -0,0 +1,197 @@
+"""
+Writing of multichannel .wav files through a memory map, so that rendered blocks
+end up in the file without intermediate copies.
+"""
+
+import struct
+import numpy as np
+
+# Sample data types by soundfile subtype name
+SUBTYPES = {
+    "PCM_16": np.dtype("<i2"),
+    "PCM_32": np.dtype("<i4"),
+    "FLOAT": np.dtype("<f4"),
+    "DOUBLE": np.dtype("<f8"),
+}
+
+# Subtype whose samples have the same data type as the rendering
+FLOAT_SUBTYPES = {np.dtype("float32"): "FLOAT", np.dtype("float64"): "DOUBLE"}
+
+# Largest data chunk of a plain RIFF file, larger files are written as RF64
+MAX_RIFF_SIZE = 0xFFFFFFFF
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# trailing part of the KSDATAFORMAT_SUBTYPE_PCM/IEEE_FLOAT GUIDs
+GUID_TAIL = b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+
+
+class MemmapWavFile:
+    """
+    A .wav file of a fixed number of frames whose sample data is memory-mapped. The
+    header is written first and the file has its final size right away, so rendered
+    frames can be read by other programs while later frames are still being written.
+    Files with more than 4 GiB of sample data are written as RF64.
+
+    Frames are written in order, either with write, like soundfile.SoundFile.write, or
+    by rendering into the array returned by block and passing it to write. If the
+    rendering dtype matches the subtype, that array is part of the memory map and
+    blocks are rendered in place.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        samplerate: int,
+        channels: int,
+        frames: int,
+        subtype: str = None,
+        dtype: str = "float64",
+    ):
+        """
+        frames: total number of frames of the file
+        subtype: sample format, one of SUBTYPES, defaults to the float subtype of dtype
+        dtype: data type blocks are rendered in
+        """
+        self.dtype = np.dtype(dtype)
+        if subtype is None:
+            subtype = FLOAT_SUBTYPES[self.dtype]
+        if subtype not in SUBTYPES:
+            raise ValueError(
+                f"Subtype has to be one of {list(SUBTYPES)}, but is {subtype}"
+            )
+
+        self.name = filename
+        self.samplerate = samplerate
+        self.channels = channels
+        self.frames = frames
+        self.subtype = subtype
+        self.closed = False
+
+        sample_type = SUBTYPES[subtype]
+        header = _wav_header(samplerate, channels, frames, sample_type)
+        with open(filename, "wb") as f:
+            f.write(header)
+            # the sample data is not written yet, this only sets the file size
+            f.truncate(len(header) + frames * channels * sample_type.itemsize)
+
+        self._data = np.memmap(
+            filename,
+            dtype=sample_type,
+            mode="r+",
+            offset=len(header),
+            shape=(frames, channels),
+        )
+        self._pos = 0
+        self._in_place = sample_type == self.dtype.newbyteorder("<")
+        self._scratch = None
+        self._pending = None
+
+    def block(self, n_frames: int) -> np.ndarray:
+        """
+        Return an array of shape (n_frames, channels) to render the next frames into,
+        which are written by passing it to write.
+        """
+        n_frames = min(n_frames, self.frames - self._pos)
+        if self._in_place:
+            self._pending = self._data[self._pos : self._pos + n_frames]
+        else:
+            if self._scratch is None or len(self._scratch) < n_frames:
+                self._scratch = np.empty((n_frames, self.channels), self.dtype)
+            self._pending = self._scratch[:n_frames]
+        return self._pending
+
+    def write(self, data: np.ndarray):
+        """
+        Write frames of shape (n_frames, channels) at the current position, float data
+        is converted to integer subtypes the same way soundfile does.
+        """
+        if data is self._pending and self._in_place:
+            self._pos += len(data)
+            self._pending = None
+            return
+
+        if self._pos + len(data) > self.frames:
+            raise ValueError(
+                f"File '{self.name}' has room for {self.frames} frames, "
+                f"but {self._pos + len(data)} were written."
+            )
+        out = self._data[self._pos : self._pos + len(data)]
+        if np.issubdtype(out.dtype, np.integer) and not np.issubdtype(
+            data.dtype, np.integer
+        ):
+            # like libsndfile: scale to 32 bits, round, clip and shift to the sample size
+            scaled = np.multiply(data, 2.0**31, dtype=float)
+            np.clip(np.rint(scaled, out=scaled), -(2**31), 2**31 - 1, out=scaled)
+            shift = 32 - 8 * out.dtype.itemsize
+            np.copyto(out, scaled.astype(np.int32) >> shift, casting="unsafe")
+        else:
+            np.copyto(out, data, casting="same_kind")
+        self._pos += len(data)
+        self._pending = None
+
+    def flush(self):
+        self._data.flush()
+
+    def close(self):
+        if not self.closed:
+            self._data.flush()
+            del self._data
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _wav_header(
+    samplerate: int, channels: int, frames: int, sample_type: np.dtype
+) -> bytes:
+    """
+    Header of a .wav file up to the start of the sample data, as RF64 if the data
+    does not fit into a RIFF file. More than two channels use WAVE_FORMAT_EXTENSIBLE.
+    """
+    is_float = np.issubdtype(sample_type, np.floating)
+    format_tag = WAVE_FORMAT_IEEE_FLOAT if is_float else WAVE_FORMAT_PCM
+    bits = 8 * sample_type.itemsize
+    block_align = channels * sample_type.itemsize
+    data_size = frames * block_align
+
+    fmt = struct.pack(
+        "<HHIIHH",
+        format_tag if channels <= 2 else WAVE_FORMAT_EXTENSIBLE,
+        channels,
+        samplerate,
+        samplerate * block_align,
+        block_align,
+        bits,
+    )
+    if channels > 2:
+        # no channel mask, loudspeaker setups are not restricted to standard positions
+        fmt += struct.pack("<HHI", 22, bits, 0) + struct.pack("<H", format_tag)
+        fmt += GUID_TAIL
+    chunks = _chunk(b"fmt ", fmt)
+
+    is_rf64 = data_size + 100 > MAX_RIFF_SIZE
+    if is_float:
+        chunks += _chunk(
+            b"fact", struct.pack("<I", MAX_RIFF_SIZE if is_rf64 else frames)
+        )
+    chunks += b"data" + struct.pack("<I", MAX_RIFF_SIZE if is_rf64 else data_size)
+
+    if not is_rf64:
+        return (
+            b"RIFF" + struct.pack("<I", 4 + len(chunks) + data_size) + b"WAVE" + chunks
+        )
+
+    ds64 = _chunk(b"ds64", struct.pack("<QQQI", 0, data_size, frames, 0))
+    riff_size = 4 + len(ds64) + len(chunks) + data_size
+    ds64 = _chunk(b"ds64", struct.pack("<QQQI", riff_size, data_size, frames, 0))
+    return b"RF64" + struct.pack("<I", MAX_RIFF_SIZE) + b"WAVE" + ds64 + chunks
+
+
+def _chunk(chunk_id: bytes, data: bytes) -> bytes:
+    return chunk_id + struct.pack("<I", len(data)) + data
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import argparse
+from contextlib import ExitStack
+from pyvbap import VbapPanner
+from pan_to_file import (
+    LS_FORMATS,
+    DEFAULT_BLOCKSIZE,
+    DTYPES,
+    get_ls_setup,
+    get_compensation,
+    open_output,
+    write_delay_tail,
+    CanNotLoadSetupFromFile,
+)
+import numpy as np
+import soundfile as sf
+import sys
+import toml
+
+
+def mix_to_file(
+    objects: list,
+    outfile: str,
+    ls_pos: dict,
+    blocksize: int = DEFAULT_BLOCKSIZE,
+    dtype: str = "float64",
+    mmap: bool = False,
+):
+    """
+    Pan several mono audio signals (objects) to their positions in a loudspeaker setup using Vbap
+    and mix them into one output file. Gains of all objects are calculated at once and every
+    block is mixed with a single matrix multiplication. Shorter objects are padded with silence.
+
+    objects: list of (file, azimuth, elevation) tuples
+    dtype: sample format of the rendering, one of DTYPES
+    mmap: if true, blocks are mixed in place into a memory-mapped output file, see open_output
+    """
+    if len(objects) == 0:
+        raise ValueError("No objects given.")
+
+    panner = VbapPanner(ls_pos["azimuth"], ls_pos["elevation"], cache=True, dtype=dtype)
+    _, obj_az, obj_el = zip(*objects)
+    # gains of shape (n_obj, n_ls)
+    gains = panner.calc_gains_batch(obj_az, obj_el)
+
+    with ExitStack() as stack:
+        files = [stack.enter_context(sf.SoundFile(obj[0])) for obj in objects]
+
+        for f in files:
+            if f.channels != 1:
+                raise ValueError(
+                    f"Object '{f.name}' has to be mono, but has {f.channels} channels."
+                )
+            if f.samplerate != files[0].samplerate:
+                raise ValueError(
+                    f"Sample rate of object '{f.name}' is {f.samplerate}, but has to be "
+                    f"{files[0].samplerate} like the first object."
+                )
+
+        trim, delay_line = get_compensation(
+            ls_pos, files[0].samplerate, blocksize, dtype
+        )
+        if trim is not None:
+            gains = gains * trim
+        n_frames = max(f.frames for f in files)
+        latency = delay_line.latency if delay_line else 0
+        f_out = stack.enter_context(
+            open_output(
+                outfile,
+                files[0].samplerate,
+                gains.shape[1],
+                n_frames + latency,
+                dtype,
+                mmap,
+            )
+        )
+        # one row per object, so that every object is read into contiguous memory
+        in_buf = np.empty((len(files), blocksize), dtype=dtype)
+        out_buf = np.empty((blocksize, gains.shape[1]), dtype=dtype)
+
+        for start in range(0, n_frames, blocksize):
+            n = min(blocksize, n_frames - start)
+            for i, f in enumerate(files):
+                n_read = len(f.read(out=in_buf[i, :n]))
+                in_buf[i, n_read:n] = 0
+
+            out = f_out.block(n) if mmap else out_buf[:n]
+            np.matmul(in_buf[:, :n].T, gains, out=out)
+            if delay_line is not None:
+                delay_line.process(out, out)
+            f_out.write(out)
+        if delay_line is not None:
+            write_delay_tail(f_out, delay_line, out_buf, mmap)
+
+
+def load_objects_file(f: str) -> list:
+    """
+    Parse a list of objects from a given toml file, see README for the format
+    """
+    try:
+        objects = toml.load(f)["objects"]
+        return [
+            (obj["file"], obj["azimuth"], obj.get("elevation", 0)) for obj in objects
+        ]
+    except (OSError, toml.TomlDecodeError, KeyError, TypeError) as e:
+        print(f"Error when loading objects from file '{f}':")
+        print(e)
+        raise CanNotLoadObjectsFromFile()
+
+
+class CanNotLoadObjectsFromFile(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pan several mono audio signals to a given loudspeaker setup using Vbap and mix them"
+    )
+    parser.add_argument(
+        "-i",
+        "--objects",
+        type=str,
+        default="",
+        help="Input .toml file listing the objects with file, azimuth and elevation",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        type=str,
+        default="mix.wav",
+        help="Output .wav file with mixed objects",
+    )
+
+    ls_text = f"Loudspeaker setup name, either path to .toml file or one of {list(LS_FORMATS.keys())}"
+    parser.add_argument("-s", "--ls_setup", type=str, default="", help=ls_text)
+
+    parser.add_argument(
+        "-b",
+        "--blocksize",
+        type=int,
+        default=DEFAULT_BLOCKSIZE,
+        help="Number of frames rendered at once, limits memory usage",
+    )
+    parser.add_argument(
+        "-d",
+        "--dtype",
+        type=str,
+        default="float64",
+        choices=DTYPES,
+        help="Sample format of the rendering, float32 halves memory bandwidth",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Mix in place into a memory-mapped float .wav file of the given dtype",
+    )
+
+    args = parser.parse_args()
+
+    if args.objects == "":
+        print("No objects file given")
+        sys.exit(1)
+
+    try:
+        ls_pos = get_ls_setup(args.ls_setup)
+        objects = load_objects_file(args.objects)
+    except (CanNotLoadSetupFromFile, CanNotLoadObjectsFromFile):
+        sys.exit(1)
+
+    mix_to_file(objects, args.outfile, ls_pos, args.blocksize, args.dtype, args.mmap)
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import argparse
-from pyvbap import VbapPanner
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pyvbap import VbapPanner, DelayLine, speaker_compensation
+from memmap_wav import MemmapWavFile
+import numpy as np
 import soundfile as sf
 import sys
 import pprint
 import os
+import time
 import toml
 
 
@@ -16,19 +21,400 @@ LS_FORMATS = {
     },
 }
 
+# Number of frames processed at once when rendering files
+DEFAULT_BLOCKSIZE = 2**16
+# Number of frames between gain updates when rendering moving sources
+DEFAULT_RAMP_SIZE = 512
+# Optional per loudspeaker values of a setup: distance to the listener in m, trim gain
+# in dB and additional delay in ms
+SETUP_COMPENSATION_KEYS = ("radius", "trim", "delay")
+# Sample formats audio can be rendered in, see README for the accuracy of float32
+DTYPES = ["float64", "float32"]
+
 
 def pan_to_file(
-    infile: str, outfile: str, ls_pos: dict, azimuth: float, elevation: float
+    infile: str,
+    outfile: str,
+    ls_pos: dict,
+    azimuth: float,
+    elevation: float,
+    blocksize: int = DEFAULT_BLOCKSIZE,
+    dtype: str = "float64",
+    mmap: bool = False,
 ):
     """
     Pan a mono audio signal to a position (azimuth and elevation) in a loudspeaker setup using Vbap.
+    The signal is rendered block by block, so memory usage does not depend on the file length.
+
+    dtype: sample format of the rendering, one of DTYPES
+    mmap: if true, blocks are rendered in place into a memory-mapped output file, see open_output
     """
-    panner = VbapPanner(ls_pos["azimuth"], ls_pos["elevation"])
+    panner = VbapPanner(ls_pos["azimuth"], ls_pos["elevation"], cache=True, dtype=dtype)
     gains = panner.calc_gains(azimuth, elevation)
 
-    s, fs = sf.read(infile)
-    out = s.reshape((-1, 1)) * gains
-    sf.write(outfile, out, fs)
+    with sf.SoundFile(infile) as f_in:
+        if f_in.channels != 1:
+            raise ValueError(
+                f"Input file has to be mono, but has {f_in.channels} channels."
+            )
+
+        trim, delay_line = get_compensation(ls_pos, f_in.samplerate, blocksize, dtype)
+        if trim is not None:
+            gains = gains * trim
+        n_frames = f_in.frames + (delay_line.latency if delay_line else 0)
+
+        with open_output(
+            outfile, f_in.samplerate, len(gains), n_frames, dtype, mmap
+        ) as f_out:
+            in_buf = np.empty(blocksize, dtype=dtype)
+            out_buf = np.empty((blocksize, len(gains)), dtype=dtype)
+            for block in f_in.blocks(out=in_buf):
+                out = f_out.block(len(block)) if mmap else out_buf[: len(block)]
+                np.multiply(block[:, np.newaxis], gains, out=out)
+                if delay_line is not None:
+                    delay_line.process(out, out)
+                f_out.write(out)
+            if delay_line is not None:
+                write_delay_tail(f_out, delay_line, out_buf, mmap)
+
+
+def pan_trajectory_to_file(
+    infile: str,
+    outfile: str,
+    ls_pos: dict,
+    trajectory: tuple,
+    blocksize: int = DEFAULT_BLOCKSIZE,
+    ramp_size: int = DEFAULT_RAMP_SIZE,
+    dtype: str = "float64",
+    mmap: bool = False,
+):
+    """
+    Pan a mono audio signal along a trajectory in a loudspeaker setup using Vbap.
+    Gains are calculated every ramp_size frames, for all ramps of a block in one batch,
+    and linearly interpolated in between to avoid zipper noise.
+
+    trajectory: tuple of keyframe arrays (time, azimuth, elevation) with times in seconds,
+                positions are linearly interpolated between keyframes and held before the
+                first and after the last keyframe
+    blocksize: number of frames rendered at once, rounded up to a multiple of ramp_size
+    dtype: sample format of the rendering, one of DTYPES
+    mmap: if true, blocks are rendered in place into a memory-mapped output file, see open_output
+    """
+    times, kf_az, kf_el = (np.asarray(kf, dtype=float) for kf in trajectory)
+    # checked by load_trajectory_file
+    assert np.all(np.diff(times) >= 0), "Keyframe times have to be in ascending order."
+
+    panner = VbapPanner(ls_pos["azimuth"], ls_pos["elevation"], cache=True, dtype=dtype)
+    n_ls = len(panner.ls_az)
+
+    n_ramps = -(-blocksize // ramp_size)
+    blocksize = n_ramps * ramp_size
+    ramp = (np.arange(ramp_size, dtype=dtype) / ramp_size)[:, np.newaxis]
+    ramp_starts = np.arange(n_ramps + 1) * ramp_size
+
+    with sf.SoundFile(infile) as f_in:
+        if f_in.channels != 1:
+            raise ValueError(
+                f"Input file has to be mono, but has {f_in.channels} channels."
+            )
+
+        trim, delay_line = get_compensation(ls_pos, f_in.samplerate, blocksize, dtype)
+        n_frames = f_in.frames + (delay_line.latency if delay_line else 0)
+
+        with open_output(
+            outfile, f_in.samplerate, n_ls, n_frames, dtype, mmap
+        ) as f_out:
+            in_buf = np.empty(blocksize, dtype=dtype)
+            out_buf = np.empty((blocksize, n_ls), dtype=dtype)
+            # per frame gains of one block, one row of ramp_size frames per ramp
+            ramp_gains = np.empty((n_ramps, ramp_size, n_ls), dtype=dtype)
+
+            start = 0
+            while (n := len(f_in.read(out=in_buf))) > 0:
+                t = (start + ramp_starts) / f_in.samplerate
+                gains = panner.calc_gains_batch(
+                    np.interp(t, times, kf_az), np.interp(t, times, kf_el)
+                )
+                if trim is not None:
+                    gains *= trim
+                np.multiply(ramp, np.diff(gains, axis=0)[:, np.newaxis], out=ramp_gains)
+                ramp_gains += gains[:-1, np.newaxis]
+
+                out = f_out.block(n) if mmap else out_buf[:n]
+                np.multiply(
+                    in_buf[:n, np.newaxis],
+                    ramp_gains.reshape((blocksize, n_ls))[:n],
+                    out=out,
+                )
+                if delay_line is not None:
+                    delay_line.process(out, out)
+                f_out.write(out)
+                start += n
+            if delay_line is not None:
+                write_delay_tail(f_out, delay_line, out_buf, mmap)
+
+
+def get_compensation(ls_pos: dict, samplerate: int, blocksize: int, dtype: str):
+    """
+    Gain factors and delay line compensating the distances (radius), trims and delays of
+    the loudspeakers of a setup, see pyvbap.speaker_compensation. The gain factors are
+    applied to the panning gains, so they cost nothing extra. Either is None if the
+    setup doesn't need it.
+    """
+    compensation = speaker_compensation(
+        len(ls_pos["azimuth"]),
+        samplerate,
+        ls_pos.get("radius"),
+        ls_pos.get("trim"),
+        ls_pos.get("delay"),
+    )
+    if compensation is None:
+        return None, None
+    gains, delays = compensation
+    trim = gains.astype(dtype) if np.any(gains != 1) else None
+    delay_line = DelayLine(delays, blocksize, dtype) if np.any(delays > 0) else None
+    return trim, delay_line
+
+
+def write_delay_tail(f_out, delay_line: DelayLine, out_buf: np.ndarray, mmap: bool):
+    """
+    Write the last delay_line.latency frames, in which delayed loudspeakers still play
+    after the end of the input.
+    """
+    for start in range(0, delay_line.latency, len(out_buf)):
+        n = min(len(out_buf), delay_line.latency - start)
+        out = f_out.block(n) if mmap else out_buf[:n]
+        delay_line.flush(out)
+        f_out.write(out)
+
+
+def open_output(
+    outfile: str,
+    samplerate: int,
+    channels: int,
+    frames: int,
+    dtype: str = "float64",
+    mmap: bool = False,
+):
+    """
+    Open the output file of a rendering. If mmap is true, a memory-mapped .wav file with
+    samples of the rendering dtype (32 or 64 bit float) is created with its final size, so
+    that blocks are rendered directly into the file and rendered frames can already be read
+    while the rendering goes on. Otherwise a 16 bit .wav file is written with soundfile.
+    """
+    if mmap:
+        return MemmapWavFile(outfile, samplerate, channels, frames, dtype=dtype)
+    return sf.SoundFile(outfile, "w", samplerate, channels)
+
+
+def render_jobs(
+    jobs: list,
+    n_workers: int = 1,
+    blocksize: int = DEFAULT_BLOCKSIZE,
+    ramp_size: int = DEFAULT_RAMP_SIZE,
+    dtype: str = "float64",
+    mmap: bool = False,
+) -> int:
+    """
+    Render a batch of jobs as loaded by load_manifest_file on a pool of worker processes,
+    printing progress and per-job timing. Each worker builds the panner of every loudspeaker
+    setup once, all its jobs of that setup reuse it through the layout cache.
+
+    n_workers: number of worker processes, if 1, jobs are rendered in this process
+
+    returns: number of failed jobs
+    """
+    setups = list({job["ls_setup"]: job["ls_pos"] for job in jobs}.values())
+    n_failed = 0
+    t_start = time.perf_counter()
+
+    pool = None
+    if n_workers == 1:
+        _init_worker(setups)
+        results = (_run_job(job, blocksize, ramp_size, dtype, mmap) for job in jobs)
+    else:
+        pool = ProcessPoolExecutor(
+            n_workers, initializer=_init_worker, initargs=(setups,)
+        )
+        futures = {
+            pool.submit(_run_job, job, blocksize, ramp_size, dtype, mmap): job
+            for job in jobs
+        }
+        results = (
+            _job_result(future, futures[future]) for future in as_completed(futures)
+        )
+
+    try:
+        for i, (job, elapsed, error) in enumerate(results):
+            prefix = f"[{i + 1}/{len(jobs)}] {job['infile']} -> {job['outfile']}"
+            if error is None:
+                print(f"{prefix} ({elapsed:.2f} s)", flush=True)
+            else:
+                n_failed += 1
+                print(f"{prefix} failed: {error}", flush=True)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    total = time.perf_counter() - t_start
+    print(
+        f"Rendered {len(jobs) - n_failed} of {len(jobs)} jobs in {total:.2f} s "
+        f"({len(jobs) / total:.2f} jobs/s)"
+    )
+    return n_failed
+
+
+def _job_result(future, job: dict) -> tuple:
+    # a crashed worker breaks the pool, its job and all jobs not done yet count as failed
+    try:
+        return future.result()
+    except Exception as e:
+        return job, 0.0, e
+
+
+def _init_worker(setups: list):
+    # construct all panners once, so that they are in the layout cache
+    for ls_pos in setups:
+        VbapPanner(ls_pos["azimuth"], ls_pos["elevation"], cache=True)
+
+
+def _run_job(
+    job: dict, blocksize: int, ramp_size: int, dtype: str, mmap: bool
+) -> tuple:
+    # errors are returned instead of raised, so that one broken job doesn't stop the batch
+    t_start = time.perf_counter()
+    try:
+        if job["trajectory"] is not None:
+            pan_trajectory_to_file(
+                job["infile"],
+                job["outfile"],
+                job["ls_pos"],
+                job["trajectory"],
+                blocksize,
+                ramp_size,
+                dtype,
+                mmap,
+            )
+        else:
+            pan_to_file(
+                job["infile"],
+                job["outfile"],
+                job["ls_pos"],
+                job["azimuth"],
+                job["elevation"],
+                blocksize,
+                dtype,
+                mmap,
+            )
+    except Exception as e:
+        return job, None, f"{type(e).__name__}: {e}"
+    return job, time.perf_counter() - t_start, None
+
+
+def load_manifest_file(f: str, default_setup: str = "") -> list:
+    """
+    Parse a list of rendering jobs from a given .csv or .toml file, see README for the format.
+    Loudspeaker setups and trajectories of all jobs are loaded here already, so that broken
+    jobs are found before rendering starts.
+
+    default_setup: loudspeaker setup for jobs that don't specify one
+    """
+    try:
+        if f.endswith(".csv"):
+            with open(f, newline="") as csv_file:
+                entries = list(csv.DictReader(csv_file))
+        else:
+            entries = toml.load(f)["jobs"]
+
+        jobs = []
+        for entry in entries:
+            jobs.append(
+                {
+                    "infile": entry["infile"],
+                    "outfile": entry["outfile"],
+                    "azimuth": float(entry.get("azimuth") or 0),
+                    "elevation": float(entry.get("elevation") or 0),
+                    "ls_setup": entry.get("ls_setup") or default_setup,
+                    "trajectory": entry.get("trajectory") or None,
+                }
+            )
+    except (OSError, ValueError, KeyError, TypeError, toml.TomlDecodeError) as e:
+        print(f"Error when loading jobs from file '{f}':")
+        print(e)
+        raise CanNotLoadManifestFromFile()
+
+    setups = {}
+    for job in jobs:
+        if job["ls_setup"] not in setups:
+            setups[job["ls_setup"]] = get_ls_setup(job["ls_setup"])
+        job["ls_pos"] = setups[job["ls_setup"]]
+        if job["trajectory"] is not None:
+            job["trajectory"] = load_trajectory_file(job["trajectory"])
+
+    return jobs
+
+
+def load_trajectory_file(f: str) -> tuple:
+    """
+    Parse keyframes (time, azimuth, elevation) of a trajectory from a given .csv or .toml
+    file. Keyframes are checked here, so that broken files fail before any rendering.
+    """
+    try:
+        if f.endswith(".csv"):
+            with open(f, newline="") as csv_file:
+                rows = [row for row in csv.reader(csv_file) if row]
+            # skip optional header line
+            if rows and not _is_number(rows[0][0]):
+                rows = rows[1:]
+            keyframes = np.asarray(rows, dtype=float)
+            if keyframes.ndim != 2 or keyframes.shape[1] != 3:
+                raise ValueError("Expected three columns: time, azimuth, elevation")
+            times, kf_az, kf_el = keyframes.T
+        else:
+            trajectory = toml.load(f)["trajectory"]
+            times = np.asarray(trajectory["time"], dtype=float)
+            kf_az = np.asarray(trajectory["azimuth"], dtype=float)
+            if "elevation" in trajectory:
+                kf_el = np.asarray(trajectory["elevation"], dtype=float)
+            else:
+                kf_el = np.zeros_like(times)
+
+        if not times.ndim == kf_az.ndim == kf_el.ndim == 1:
+            raise ValueError("Time, azimuth and elevation have to be lists of numbers.")
+        if not len(times) == len(kf_az) == len(kf_el):
+            raise ValueError(
+                f"Time, azimuth and elevation have to be of the same length, but have "
+                f"{len(times)}, {len(kf_az)} and {len(kf_el)} values."
+            )
+        if len(times) == 0:
+            raise ValueError("Trajectory has no keyframes.")
+        if not np.all(np.isfinite(np.stack([times, kf_az, kf_el]))):
+            raise ValueError("Keyframes have to be finite numbers.")
+        if np.any(np.diff(times) < 0):
+            raise ValueError("Keyframe times have to be in ascending order.")
+        return times, kf_az, kf_el
+    except (OSError, ValueError, KeyError, TypeError, toml.TomlDecodeError) as e:
+        print(f"Error when loading trajectory from file '{f}':")
+        print(e)
+        raise CanNotLoadTrajectoryFromFile()
+
+
+def _positive_int(s: str) -> int:
+    try:
+        n = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"has to be an integer, but is '{s}'")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"has to be at least 1, but is {n}")
+    return n
+
+
+def _is_number(s: str) -> bool:
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
 
 
 def load_setup_file(f: str) -> dict:
@@ -52,13 +438,51 @@ def load_setup_file(f: str) -> dict:
         )
         raise CanNotLoadSetupFromFile()
 
-    return setup["positions"]
+    positions = setup["positions"]
+    # optional values per loudspeaker, see speaker_compensation
+    for key in ("elevation", *SETUP_COMPENSATION_KEYS):
+        if key in positions and len(positions[key]) != len(positions["azimuth"]):
+            print(
+                f"Setup file lists {len(positions['azimuth'])} azimuth angles, "
+                f"but {len(positions[key])} values for {key}."
+            )
+            raise CanNotLoadSetupFromFile()
+
+    return positions
+
+
+def get_ls_setup(ls_setup: str) -> dict:
+    """
+    Get loudspeaker positions by name of a pre-defined format or from a toml file
+    """
+    if ls_setup in LS_FORMATS.keys():
+        return LS_FORMATS[ls_setup]
+
+    if not os.path.isfile(ls_setup):
+        print(
+            f"Given loudspeaker setup '{ls_setup}' is neither a file nor part of the pre-defined formats."
+        )
+        raise CanNotLoadSetupFromFile()
+
+    try:
+        return load_setup_file(ls_setup)
+    except CanNotLoadSetupFromFile:
+        print(f"Could not load setup from file '{ls_setup}'")
+        raise
 
 
 class CanNotLoadSetupFromFile(Exception):
     pass
 
 
+class CanNotLoadTrajectoryFromFile(Exception):
+    pass
+
+
+class CanNotLoadManifestFromFile(Exception):
+    pass
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Pan mono audio signal to a given loudspeaker setup using Vbap"
@@ -84,6 +508,59 @@ if __name__ == "__main__":
         "-el", "--elevation", type=int, default=0, help="Elevation angle for panning"
     )
 
+    parser.add_argument(
+        "-t",
+        "--trajectory",
+        type=str,
+        default="",
+        help="Pan along the trajectory from a .csv or .toml keyframe file instead of a fixed position",
+    )
+    parser.add_argument(
+        "-r",
+        "--ramp_size",
+        type=int,
+        default=DEFAULT_RAMP_SIZE,
+        help="Number of frames between gain updates along a trajectory",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--blocksize",
+        type=int,
+        default=DEFAULT_BLOCKSIZE,
+        help="Number of frames rendered at once, limits memory usage",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dtype",
+        type=str,
+        default="float64",
+        choices=DTYPES,
+        help="Sample format of the rendering, float32 halves memory bandwidth",
+    )
+
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Render in place into a memory-mapped float .wav file of the given dtype",
+    )
+
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default="",
+        help="Render all jobs listed in a .csv or .toml file instead of a single file",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_positive_int,
+        default=os.cpu_count(),
+        help="Number of worker processes for rendering the jobs of a manifest",
+    )
+
     parser.add_argument(
         "-l",
         "--list_setups",
@@ -100,23 +577,51 @@ if __name__ == "__main__":
 
     infile, outfile, ls_setup = args.infile, args.outfile, args.ls_setup
 
+    if args.manifest != "":
+        try:
+            jobs = load_manifest_file(args.manifest, ls_setup)
+        except (
+            CanNotLoadManifestFromFile,
+            CanNotLoadSetupFromFile,
+            CanNotLoadTrajectoryFromFile,
+        ):
+            sys.exit(1)
+
+        n_failed = render_jobs(
+            jobs, args.jobs, args.blocksize, args.ramp_size, args.dtype, args.mmap
+        )
+        sys.exit(1 if n_failed > 0 else 0)
+
     if infile == "":
         print("No input file given")
         sys.exit(1)
 
-    # get loudspeaker setup
-    if ls_setup in LS_FORMATS.keys():
-        ls_pos = LS_FORMATS[ls_setup]
-    elif os.path.isfile(ls_setup):
-        try:
-            ls_pos = load_setup_file(ls_setup)
-        except CanNotLoadSetupFromFile:
-            print("Could not load setup from file '{ls_setup}'")
-            sys.exit(1)
-    else:
-        print(
-            f"Given loudspeaker setup '{ls_setup}' is neither a file nor part of the pre-defined formats."
-        )
+    try:
+        ls_pos = get_ls_setup(ls_setup)
+        if args.trajectory != "":
+            trajectory = load_trajectory_file(args.trajectory)
+    except (CanNotLoadSetupFromFile, CanNotLoadTrajectoryFromFile):
         sys.exit(1)
 
-    pan_to_file(infile, outfile, ls_pos, args.azimuth, args.elevation)
+    if args.trajectory != "":
+        pan_trajectory_to_file(
+            infile,
+            outfile,
+            ls_pos,
+            trajectory,
+            args.blocksize,
+            args.ramp_size,
+            args.dtype,
+            args.mmap,
+        )
+    else:
+        pan_to_file(
+            infile,
+            outfile,
+            ls_pos,
+            args.azimuth,
+            args.elevation,
+            args.blocksize,
+            args.dtype,
+            args.mmap,
+        )
@@ -23,7 +23,7 @@ GUI_CONFIG = {
 
             'line_colour_out': 'red',
             'line_colour_in': 'green',
-    
+
             # dict containing graphic path and scaling size for all widgets
             'widgets': {
                     'ls': ['graphics/loudspeaker_small.png', None],
@@ -37,6 +37,15 @@ GUI_CONFIG = {
 
             'audio_bufsize': 1024,
             'error_duration': 3,
+
+            # mouse events are coalesced and drawn once per refresh, about the frame
+            # rate of a display
+            'refresh_ms': 16,
+            # interval of reading the gains of the player for the gain meter
+            'meter_ms': 50,
+            'meter_colour': 'orange',
+            'meter_length': 80,
+            'meter_width': 6,
         }
 
 
@@ -60,7 +69,7 @@ def convert_angle(angle):
 class PannerGui():
 
     def __init__(self, ls_az):
-        
+
         # set up player
         self.ls_az = ls_az
         ls_el = [0] * len(self.ls_az)
@@ -98,6 +107,17 @@ class PannerGui():
         self.ls_high = None
         self.draw_loudspeakers()
 
+        # gain meter: a bar per loudspeaker pointing to the listener and a line connecting
+        # the active loudspeakers, only moved and shown/hidden by update_meter
+        self.meter_bars = [self.bg.create_line(0, 0, 0, 0, state=tk.HIDDEN,
+                                               fill=GUI_CONFIG['meter_colour'],
+                                               width=GUI_CONFIG['meter_width'])
+                           for _ in self.ls_az]
+        self.active_line = self.bg.create_line(0, 0, 0, 0, state=tk.HIDDEN,
+                                               fill=GUI_CONFIG['meter_colour'])
+        self.meter_gains = None
+        self.meter_az = None
+
         # draw sound position indicator
         sound_pos_zero = polar_to_screen(0, R, GUI_CONFIG['win_width'],
                                           GUI_CONFIG['win_height'])
@@ -126,14 +146,23 @@ class PannerGui():
         self.file_display = tk.Label(self.root, text='', bg='white', fg='black')
         self.file_display.grid(row=1, column=0, sticky='n')
 
-        # line to cursor position
-        self.cursor_line = None
-        self.angle_text = None
+        # line to cursor position with annotated angle, only moved by draw_cursor
+        self.cursor_line = self.bg.create_line(0, 0, 0, 0, state=tk.HIDDEN)
+        self.angle_text = self.bg.create_text(0, 0, text='', state=tk.HIDDEN)
+
+        # latest cursor position and panning angle since the last refresh, mouse events
+        # only store them and schedule a refresh
+        self.pending_cursor = None
+        self.pending_angle = None
+        self.refresh_scheduled = False
 
-        # events on the top-down-view canvas
+        # events on the top-down-view canvas, dragging pans continuously
         self.bg.bind('<Motion>', self.mouse_move)
         self.bg.bind('<Button-1>', self.mouse_click)
+        self.bg.bind('<B1-Motion>', self.mouse_drag)
+        self.bg.bind('<Leave>', self.mouse_leave)
 
+        self.update_meter()
         self.root.mainloop()
 
 
@@ -148,7 +177,6 @@ class PannerGui():
         self.root.destroy()
 
     def draw_loudspeakers(self):
-        print("draw ls")
         for ang in self.ls_widgets:
             self.bg.delete(self.ls_widgets[ang])
 
@@ -156,10 +184,9 @@ class PannerGui():
 
         for ang in self.ls_az:
             x, y = polar_to_screen(ang,
-                                    GUI_CONFIG['spkr_radius'], 
+                                    GUI_CONFIG['spkr_radius'],
                                     GUI_CONFIG['win_width'],
                                     GUI_CONFIG['win_height'])
-            print(ang, x, y)
             self.ls_widgets[ang] = self.bg.create_image(x, y, anchor=tk.CENTER,
                                                         image=self.widgets['ls'])
 
@@ -192,35 +219,62 @@ class PannerGui():
         sleep(GUI_CONFIG['error_duration'])
         self.error_display.configure(text='')
 
-    def move_sound_widget(self, old_angle, new_angle):
+    def move_sound_widget(self, angle):
         """
-        Move the sound position widget to a new place and/or hide/unhide it.
+        Move the sound position widget to the given angle.
         """
-        x_curr, y_curr = polar_to_screen(old_angle, GUI_CONFIG['spkr_radius'],
-                                          GUI_CONFIG['win_width'],
-                                          GUI_CONFIG['win_height'])
-        x_new, y_new = polar_to_screen(new_angle, GUI_CONFIG['spkr_radius'],
-                                        GUI_CONFIG['win_width'],
-                                        GUI_CONFIG['win_height'])
-        print(x_curr, y_curr, x_new, y_new)
-        x_rel = x_new - x_curr
-        y_rel = y_new - y_curr
-        self.bg.move(self.sound_widget, x_rel, y_rel)
+        x, y = polar_to_screen(angle, GUI_CONFIG['spkr_radius'],
+                               GUI_CONFIG['win_width'],
+                               GUI_CONFIG['win_height'])
+        self.bg.coords(self.sound_widget, x, y)
 
-    def mouse_click(self, event):
-        x, y = event.x, event.y
+    def pan_angle(self, x, y):
+        """
+        Panning angle at a mouse position, limited to the allowed panning range.
+        """
         new_angle, _ = screen_to_polar(x,  y, GUI_CONFIG['win_width'],
                                         GUI_CONFIG['win_height'])
         if new_angle > 180:
             new_angle -= 360
-        new_angle = max(min(int(new_angle), self.bounds[1]), self.bounds[0])
+        return max(min(int(new_angle), self.bounds[1]), self.bounds[0])
 
-        print("new angle:", new_angle)
-        self.move_sound_widget(self.player.az, new_angle)
-        self.player.set_position(new_angle, 0)
+    def mouse_click(self, event):
+        self.pending_angle = self.pan_angle(event.x, event.y)
+        self.schedule_refresh()
+
+    def mouse_drag(self, event):
+        self.pending_cursor = (event.x, event.y)
+        self.pending_angle = self.pan_angle(event.x, event.y)
+        self.schedule_refresh()
 
     def mouse_move(self, event):
-        x, y = event.x, event.y
+        self.pending_cursor = (event.x, event.y)
+        self.schedule_refresh()
+
+    def mouse_leave(self, event):
+        self.pending_cursor = None
+        self.bg.itemconfigure(self.cursor_line, state=tk.HIDDEN)
+        self.bg.itemconfigure(self.angle_text, state=tk.HIDDEN)
+        self.highlight_loudspeaker(None)
+
+    def schedule_refresh(self):
+        # events until the next refresh only replace the pending cursor and angle
+        if not self.refresh_scheduled:
+            self.refresh_scheduled = True
+            self.root.after(GUI_CONFIG['refresh_ms'], self.refresh)
+
+    def refresh(self):
+        self.refresh_scheduled = False
+
+        if self.pending_angle is not None:
+            self.move_sound_widget(self.pending_angle)
+            self.player.set_position(self.pending_angle, 0)
+            self.pending_angle = None
+
+        if self.pending_cursor is not None:
+            self.draw_cursor(*self.pending_cursor)
+
+    def draw_cursor(self, x, y):
         # compute angle in listener coordinates
         angle, radius = screen_to_polar(x,  y, GUI_CONFIG['win_width'],
                                          GUI_CONFIG['win_height'])
@@ -232,40 +286,73 @@ class PannerGui():
         else:
             line_colour = GUI_CONFIG['line_colour_in']
 
-        # draw red line with annotated angle
-        if self.cursor_line is not None:
-            self.bg.delete(self.cursor_line)
-        if self.angle_text is not None:
-            self.bg.delete(self.angle_text)
+        # move line with annotated angle
         x_r, y_r = polar_to_screen(angle, GUI_CONFIG['spkr_radius'],
                                     GUI_CONFIG['win_width'], GUI_CONFIG['win_width'])
-        self.cursor_line = self.bg.create_line(self.x_mid, self.y_mid, x_r, y_r,
-                                               fill=line_colour)
+        self.bg.coords(self.cursor_line, self.x_mid, self.y_mid, x_r, y_r)
+        self.bg.itemconfigure(self.cursor_line, fill=line_colour, state=tk.NORMAL)
         x_text, y_text = polar_to_screen(angle + 10, GUI_CONFIG['spkr_radius'] / 3,
                                           GUI_CONFIG['win_width'], GUI_CONFIG['win_width'])
 
         # use converted angle for text display
-        angle = conv_angle
-        self.angle_text = self.bg.create_text(x_text, y_text, text='{}°'.format(angle),
-                                              fill=line_colour)
+        self.bg.coords(self.angle_text, x_text, y_text)
+        self.bg.itemconfigure(self.angle_text, text='{}°'.format(conv_angle),
+                              fill=line_colour, state=tk.NORMAL)
 
         # if there is a speaker at the current angle, highlight that speaker
-        if angle in self.ls_widgets.keys():
-            self.bg.delete(self.ls_widgets[angle])
-            x_spkr, y_spkr = polar_to_screen(angle, GUI_CONFIG['spkr_radius'],
-                                              GUI_CONFIG['win_width'],
-                                              GUI_CONFIG['win_height'])
-            self.ls_widgets[angle] = self.bg.create_image(x_spkr, y_spkr, anchor=tk.CENTER,
-                                                          image=self.widgets['ls_highlight'])
-            self.ls_high = angle
-        elif self.ls_high is not None:
-            self.bg.delete(self.ls_widgets[self.ls_high])
-            x_spkr, y_spkr = polar_to_screen(self.ls_high, GUI_CONFIG['spkr_radius'],
-                                              GUI_CONFIG['win_width'], GUI_CONFIG['win_height'])
-            self.ls_widgets[self.ls_high] = self.bg.create_image(x_spkr, y_spkr,
-                                                                 anchor=tk.CENTER,
-                                                                 image=self.widgets['ls'])
-            self.ls_high = None
+        self.highlight_loudspeaker(conv_angle if conv_angle in self.ls_widgets else None)
+
+    def highlight_loudspeaker(self, angle):
+        if angle == self.ls_high:
+            return
+        if self.ls_high is not None:
+            self.bg.itemconfigure(self.ls_widgets[self.ls_high], image=self.widgets['ls'])
+        if angle is not None:
+            self.bg.itemconfigure(self.ls_widgets[angle], image=self.widgets['ls_highlight'])
+        self.ls_high = angle
+
+    def update_meter(self):
+        """
+        Show the gains of the sound as bars at the loudspeakers and connect the active
+        loudspeakers. Runs periodically in the Tk loop and reads the gains from the player's
+        control state, the audio thread is not involved. The sound widget follows position
+        changes that didn't come from the gui as well, e.g. from a ControlServer.
+        """
+        self.root.after(GUI_CONFIG['meter_ms'], self.update_meter)
+
+        if self.player.az != self.meter_az:
+            self.meter_az = self.player.az
+            self.move_sound_widget(self.meter_az)
+
+        gains = self.player.source_gains()
+        if gains is None or (self.meter_gains is not None
+                             and np.array_equal(gains, self.meter_gains)):
+            return
+        self.meter_gains = gains
+
+        r_bar = GUI_CONFIG['spkr_radius'] - 30
+        active = []
+        for bar, ang, gain in zip(self.meter_bars, self.ls_az, gains):
+            if gain <= 0:
+                self.bg.itemconfigure(bar, state=tk.HIDDEN)
+                continue
+            x, y = polar_to_screen(ang, r_bar, GUI_CONFIG['win_width'],
+                                   GUI_CONFIG['win_height'])
+            x_end, y_end = polar_to_screen(ang, r_bar - gain * GUI_CONFIG['meter_length'],
+                                           GUI_CONFIG['win_width'],
+                                           GUI_CONFIG['win_height'])
+            self.bg.coords(bar, x, y, x_end, y_end)
+            self.bg.itemconfigure(bar, state=tk.NORMAL)
+            active.append((x, y))
+
+        if len(active) > 1:
+            # outline of the active pair or triangle
+            if len(active) > 2:
+                active.append(active[0])
+            self.bg.coords(self.active_line, *np.ravel(active))
+            self.bg.itemconfigure(self.active_line, state=tk.NORMAL)
+        else:
+            self.bg.itemconfigure(self.active_line, state=tk.HIDDEN)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,12 @@
-from .vbap_panner import VbapPanner, CanNotConstructConvexHull
+from .vbap_panner import VbapPanner, GainTable, CanNotConstructConvexHull
+from .stats import Stats
+from .compensation import DelayLine, speaker_compensation
 
-__all__ = ["VbapPanner", "CanNotConstructConvexHull"]
+__all__ = [
+    "VbapPanner",
+    "GainTable",
+    "CanNotConstructConvexHull",
+    "Stats",
+    "DelayLine",
+    "speaker_compensation",
+]
@@ -0,0 +1,150 @@
+"""
+Compensation of loudspeakers at different distances from the listener. VbapPanner only
+models directions, the gain and delay of every loudspeaker are applied to the rendered
+output: gains by scaling the panning gains, delays with a DelayLine.
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Speed of sound in air at 20 degrees Celsius in m/s
+SPEED_OF_SOUND = 343.0
+
+
+def speaker_compensation(
+    n_ls: int,
+    samplerate: float,
+    radius: Optional[Sequence[float]] = None,
+    trim: Optional[Sequence[float]] = None,
+    delay: Optional[Sequence[float]] = None,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Calculate gain factors and delays in samples, so that all loudspeakers sound as if
+    they were as far from the listener as the farthest one. Returns None if neither of
+    radius, trim or delay is given.
+
+    radius: distance of each loudspeaker to the listener in m. Nearer loudspeakers are
+            delayed by the difference in travel time and attenuated by the ratio of
+            distances (1/r law)
+    trim: additional gain of each loudspeaker in dB
+    delay: additional delay of each loudspeaker in ms
+    """
+    if radius is None and trim is None and delay is None:
+        return None
+
+    gains = np.ones(n_ls)
+    delays = np.zeros(n_ls)
+    for name, values in (("radius", radius), ("trim", trim), ("delay", delay)):
+        if values is not None and len(values) != n_ls:
+            raise ValueError(
+                f"Setup has {n_ls} loudspeakers, but {len(values)} values for {name}."
+            )
+
+    if radius is not None:
+        radius = np.asarray(radius, dtype=float)
+        if np.any(radius <= 0):
+            raise ValueError("Loudspeaker radius has to be positive.")
+        r_max = radius.max()
+        gains *= radius / r_max
+        delays += (r_max - radius) / SPEED_OF_SOUND * samplerate
+    if trim is not None:
+        gains *= 10 ** (np.asarray(trim, dtype=float) / 20)
+    if delay is not None:
+        delay = np.asarray(delay, dtype=float)
+        if np.any(delay < 0):
+            raise ValueError("Loudspeaker delay can not be negative.")
+        delays += delay / 1000 * samplerate
+
+    return gains, delays
+
+
+class DelayLine:
+    """
+    Delays each channel of a block of frames by its own, possibly fractional, number of
+    samples. Fractional delays are linearly interpolated between two neighbouring
+    samples. All buffers are allocated at construction, so process can run in an audio
+    callback.
+
+    The history of all channels is kept in a circular buffer of frames. The delayed
+    windows of all channels are read at once with one wrapping take from precomputed
+    indices, so the cost per block hardly depends on the number of channels.
+    """
+
+    def __init__(self, delays: Sequence[float], blocksize: int, dtype=np.float64):
+        """
+        delays: delay of each channel in samples
+        blocksize: maximum number of frames passed to process at once
+        """
+        delays = np.asarray(delays, dtype=float)
+        if np.any(delays < 0):
+            raise ValueError("Delays can not be negative.")
+        self.delays = delays
+        self.blocksize = blocksize
+        # number of frames the output is longer than the input, see flush
+        self.latency = int(np.ceil(delays.max())) if len(delays) > 0 else 0
+
+        n_ch = len(delays)
+        int_delays = np.floor(delays).astype(np.intp)
+        self._frac = (delays - int_delays).astype(dtype)
+        # one sample more than the largest delay for interpolating fractional delays
+        self._len = blocksize + self.latency + 1
+        self._buf = np.zeros((self._len, n_ch), dtype=dtype)
+        self._pos = 0
+
+        # flat buffer index of frame i of the window of channel c, relative to the write
+        # position. Windows start one frame before the delayed block, indices outside of
+        # the buffer wrap around
+        frames = np.arange(blocksize + 1)[:, np.newaxis] - int_delays - 1
+        self._rel_idx = frames * n_ch + np.arange(n_ch)
+        self._idx = np.zeros((blocksize + 1, n_ch), dtype=np.intp)
+        self._taps = np.zeros((blocksize + 1, n_ch), dtype=dtype)
+        self._tmp = np.zeros((blocksize, n_ch), dtype=dtype)
+
+    def process(self, block: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        Delay a block of shape (n_frames, n_channels), out may be the block itself.
+        Blocks can have at most blocksize frames.
+        """
+        n = len(block)
+        if n > self.blocksize:
+            raise ValueError(
+                f"Blocks can have at most {self.blocksize} frames, but have {n}."
+            )
+        if out is None:
+            out = np.empty_like(block)
+        buf_len = self._len
+
+        # write the block at pos, wrapping around at the end
+        pos = self._pos
+        n_end = min(n, buf_len - pos)
+        self._buf[pos : pos + n_end] = block[:n_end]
+        self._buf[: n - n_end] = block[n_end:]
+
+        # taps[i, c] = x_c[i - d_c - 1] for i = 0 .. n
+        idx = self._idx[: n + 1]
+        np.add(self._rel_idx[: n + 1], pos * self._buf.shape[1], out=idx)
+        taps = self._taps[: n + 1]
+        np.take(self._buf.reshape(-1), idx, out=taps, mode="wrap")
+
+        # x[i - d - frac] = x[i - d] + frac * (x[i - d - 1] - x[i - d])
+        tmp = self._tmp[:n]
+        np.subtract(taps[:-1], taps[1:], out=tmp)
+        tmp *= self._frac
+        np.add(taps[1:], tmp, out=out, casting="same_kind")
+
+        self._pos = (pos + n) % buf_len
+        return out
+
+    def flush(self, out: np.ndarray) -> np.ndarray:
+        """
+        Output the delayed samples still in the buffers, i.e. process silence of the
+        length of out, which may be longer than blocksize. All delayed samples are output
+        with latency frames.
+        """
+        out.fill(0)
+        for start in range(0, len(out), self.blocksize):
+            chunk = out[start : start + self.blocksize]
+            self.process(chunk, chunk)
+        return out
@@ -0,0 +1,146 @@
+"""
+Cache for the triangulation of loudspeaker setups, so that the convex hull
+construction and base inversion only have to be done once per setup.
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+# Bump when the layout of cached data changes, old cache files are ignored then
+CACHE_VERSION = 1
+
+
+class Triangulation(NamedTuple):
+    """
+    Triangulation of a loudspeaker setup as used by VbapPanner.
+    """
+
+    triangles: np.ndarray
+    neighbors: np.ndarray
+    inv_bases: np.ndarray
+
+
+def layout_key(ls_az: np.ndarray, ls_el: np.ndarray, is_2d: bool) -> str:
+    """
+    Calculate a hash identifying a loudspeaker setup.
+
+    ls_az: loudspeaker azimuth angles in degrees
+    ls_el: loudspeaker elevation angles in degrees
+    is_2d: flag, if true, setup is treated as 2-D setup
+    """
+    h = hashlib.sha1(f"v{CACHE_VERSION},{len(ls_az)},{is_2d}".encode())
+    h.update(np.ascontiguousarray(ls_az, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(ls_el, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def default_cache_dir() -> str:
+    """
+    Directory for cache files, taken from the environment variable
+    PYVBAP_CACHE_DIR or the user's cache directory.
+    """
+    if "PYVBAP_CACHE_DIR" in os.environ:
+        return os.environ["PYVBAP_CACHE_DIR"]
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "pyvbap")
+
+
+class LayoutCache:
+    """
+    Two level cache of triangulations: an in-process LRU in front of .npz
+    files in a cache directory. Cached arrays are read-only, as they are shared
+    between all panners of the same setup.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, maxsize: int = 16):
+        """
+        cache_dir: directory for cache files, if None, default_cache_dir() is used
+        maxsize: maximum number of triangulations kept in memory
+        """
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+
+    def get(self, key: str) -> Optional[Triangulation]:
+        """
+        Return the cached triangulation for the given layout key, or None on a
+        cache miss.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = Triangulation(*(data[name] for name in Triangulation._fields))
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            # unreadable, e.g. empty after a crash, remove it so it is rewritten
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Triangulation):
+        """
+        Store a triangulation in memory and on disk. Failing to write the cache
+        file is not an error, the triangulation is only kept in memory then.
+        """
+        self._remember(key, entry)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first, so that concurrent processes
+            # never read half-written cache files
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **entry._asdict())
+                # make sure the data is on disk before the file gets its final name
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            os.remove(tmp_path)
+
+    def clear(self):
+        """
+        Remove all cached triangulations from memory and disk.
+        """
+        self._memory.clear()
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key: str, entry: Triangulation):
+        for arr in entry:
+            arr.setflags(write=False)
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+
+# Cache shared by all panners created with cache=True
+DEFAULT_CACHE = LayoutCache()
@@ -0,0 +1,89 @@
+"""
+Counters and timers for profiling the hot paths of VbapPanner and VbapPlayer.
+Instrumented code only updates a Stats instance if one was passed, so there is
+no overhead beyond a None check when profiling is disabled.
+"""
+
+import json
+import sys
+import time
+from threading import Event, Thread
+from typing import Optional, TextIO
+
+
+class Stats:
+    """
+    Named event counters and duration timers. Updates are not locked, so
+    concurrent updates of the same counter from several threads may
+    occasionally be lost, which is acceptable for profiling.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        # name -> [number of durations, total seconds, max seconds]
+        self._timers = {}
+        self._dump_stop = None
+        self._dump_thread = None
+
+    def count(self, name: str, n: int = 1):
+        """
+        Add n to the counter with the given name.
+        """
+        self._counts[name] = self._counts.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float):
+        """
+        Record a duration for the timer with the given name.
+        """
+        timer = self._timers.get(name)
+        if timer is None:
+            self._timers[name] = [1, seconds, seconds]
+            return
+        timer[0] += 1
+        timer[1] += seconds
+        if seconds > timer[2]:
+            timer[2] = seconds
+
+    def snapshot(self) -> dict:
+        """
+        Return a copy of all counters and timers. Timers are reported with
+        their count, total, mean and max duration in seconds.
+        """
+        timers = {}
+        for name, (n, total, max_time) in list(self._timers.items()):
+            timers[name] = {
+                "count": n,
+                "total": total,
+                "mean": total / n,
+                "max": max_time,
+            }
+        return {"counts": dict(self._counts), "timers": timers}
+
+    def reset(self):
+        self._counts = {}
+        self._timers = {}
+
+    def dump_periodically(self, interval: float, file: Optional[TextIO] = None):
+        """
+        Write a snapshot as one line of json to file (stderr by default) every
+        interval seconds in a background thread, until stop_dump is called.
+        """
+        self.stop_dump()
+        file = sys.stderr if file is None else file
+        self._dump_stop = Event()
+        self._dump_thread = Thread(
+            target=self._dump, args=(interval, file, self._dump_stop), daemon=True
+        )
+        self._dump_thread.start()
+
+    def stop_dump(self):
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+    def _dump(self, interval: float, file: TextIO, stop: Event):
+        while not stop.wait(interval):
+            snapshot = self.snapshot()
+            snapshot["time"] = time.time()
+            print(json.dumps(snapshot), file=file, flush=True)
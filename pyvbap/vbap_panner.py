@@ -3,20 +3,83 @@ Implementation of the VBAP method for panning a source in (almost) arbitrary
 speaker setups.
 """
 
+import operator
+import time
 import numpy as np
 from numpy.typing import ArrayLike
-from typing import Union, Optional
-from scipy.spatial import ConvexHull
-from scipy.spatial.qhull import QhullError
+from typing import Union, Optional, Tuple
+from .layout_cache import DEFAULT_CACHE, LayoutCache, Triangulation, layout_key
+from .stats import Stats
 
 
 DEG_2_RAD = np.pi / 180
 
+# Gains of the active triangle/pair may come out as tiny negative numbers for
+# sources that lie exactly on an edge or at a loudspeaker position
+GAIN_TOL = 1e-9
+# Data types gains can be calculated in. With float32, gains deviate from
+# float64 gains by less than FLOAT32_GAIN_ERROR
+DTYPES = (np.float64, np.float32)
+FLOAT32_GAIN_ERROR = 1e-5
+# Bases with a determinant below this are degenerate (e.g. a triangle whose
+# loudspeakers lie in one plane with the listener) and can not be inverted
+DET_TOL = 1e-9
+# Upper bound for the number of (direction, triangle) gain candidates that are
+# evaluated at once in batch calculations, limits temporary memory usage
+BATCH_CHUNK_SIZE = 2**18
+# Strategies for finding the active triangle of a single source direction:
+# "scan" tests all triangles, "walk" starts at the last active triangle and
+# walks over neighbouring triangles towards the source direction
+LOOKUP_STRATEGIES = ("scan", "walk")
+# Number of virtual sources on the ring around the direction of a spread
+# source (MDAP), in addition to the one in the direction itself
+SPREAD_DIRECTIONS = 16
+# Number of spread widths whose virtual source directions are kept
+SPREAD_CACHE_SIZE = 32
+
 
 class VbapPanner:
-    def __init__(self, ls_az: ArrayLike, ls_el: Optional[ArrayLike] = None):
+    def __init__(
+        self,
+        ls_az: ArrayLike,
+        ls_el: Optional[ArrayLike] = None,
+        lookup: str = "scan",
+        cache: Union[bool, LayoutCache] = False,
+        stats: Union[bool, Stats] = False,
+        dtype: type = np.float64,
+    ):
+        """
+        ls_az: loudspeaker azimuth angles in degrees
+        ls_el: loudspeaker elevation angles in degrees, 2-D setup if omitted or all zero
+        lookup: strategy for finding the active triangle, one of LOOKUP_STRATEGIES,
+                "walk" keeps single lookups near constant time for dense setups
+                and yields the same gains as "scan"
+        cache: if true, the triangulation of the setup is taken from/stored in
+               the default LayoutCache, a LayoutCache instance can be passed to
+               use a different cache directory
+        stats: if true, lookups, triangles tested, cache hits/misses and the
+               time spent in triangulation, triangle search and gain
+               calculation are recorded in self.stats, a Stats instance can
+               be passed to share it with other objects
+        dtype: data type of the stored loudspeaker vectors and inverted bases
+               and of calculated gains, one of DTYPES. float32 halves memory
+               and bandwidth, gains are accurate to FLOAT32_GAIN_ERROR then
+        """
+        if lookup not in LOOKUP_STRATEGIES:
+            raise ValueError(
+                f"Lookup has to be one of {LOOKUP_STRATEGIES}, but is {lookup}"
+            )
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in DTYPES:
+            raise ValueError(f"Dtype has to be one of {DTYPES}, but is {dtype}")
+        # gains slightly below zero are accepted as rounding errors
+        self._gain_tol = max(GAIN_TOL, 8 * np.finfo(self.dtype).eps)
+        self.lookup = lookup
+        self._last_tri_idx = 0
+        self.stats = Stats() if stats is True else (stats or None)
+
         self.ls_az = np.asarray(ls_az, dtype=float)
-        if ls_el is None or np.all((el_arr := np.asarray(ls_el, dtype=float) == 0)):
+        if ls_el is None or np.all((el_arr := np.asarray(ls_el, dtype=float)) == 0):
             self.is_2d = True
             self.ls_el = np.zeros(self.ls_az.shape)
         else:
@@ -25,55 +88,230 @@ class VbapPanner:
 
         self.ls_vec = ang_to_cart(self.ls_az, self.ls_el, self.is_2d)
 
-        try:
-            self.triangles = ConvexHull(self.ls_vec.T).simplices
-        except QhullError:
-            raise CanNotConstructConvexHull(
-                "Error at complex hull construction. Your loudspeaker setup might be invalid!"
-            )
+        if cache is True:
+            cache = DEFAULT_CACHE
+        if cache:
+            key = layout_key(self.ls_az, self.ls_el, self.is_2d)
+            triangulation = cache.get(key)
+            if triangulation is None:
+                triangulation = self._triangulate()
+                cache.put(key, triangulation)
+                if self.stats is not None:
+                    self.stats.count("cache_misses")
+            elif self.stats is not None:
+                self.stats.count("cache_hits")
+        else:
+            triangulation = self._triangulate()
+
+        self.triangles = triangulation.triangles
+        # neighbors[i, k] is the triangle opposite to loudspeaker triangles[i, k]
+        self.neighbors = triangulation.neighbors
+        # triangulation is always done in float64, so cached data is the same for all dtypes
+        self.ls_vec = self.ls_vec.astype(self.dtype, copy=False)
+        self.inv_bases = triangulation.inv_bases.astype(self.dtype, copy=False)
+        # disabled loudspeakers are not part of the triangulation and get zero gain
+        self.enabled = np.ones(len(self.ls_az), dtype=bool)
+        self._init_lookup()
+        # virtual source directions of spread sources by width, see _spread_kernel
+        self._spread_kernels = {}
+
+    def _triangulate(self) -> Triangulation:
+        if self.stats is None:
+            return triangulate(self.ls_vec)
+        t_start = time.perf_counter()
+        triangulation = triangulate(self.ls_vec)
+        self.stats.add_time("triangulation", time.perf_counter() - t_start)
+        return triangulation
+
+    def _init_lookup(self):
+        """
+        Prepare the data used by the configured lookup strategy. The walk
+        takes many tiny steps, which are much cheaper on python lists than on
+        numpy arrays.
+        """
+        if self.lookup == "walk":
+            self._walk_inv_bases = self.inv_bases.tolist()
+            self._walk_neighbors = self.neighbors.tolist()
+            self._walk_valid = (~np.isnan(self.inv_bases[:, 0, 0])).tolist()
 
     def calc_gains(
-        self, az: float, el: float, base: Optional[np.ndarray] = None
+        self,
+        az: float,
+        el: float,
+        base: Optional[np.ndarray] = None,
+        spread: float = 0,
     ) -> np.ndarray:
         """
         Calculate gains for all loudspeakers to position a source at the
         given azimuth and elevation. Inacitve triplets will have zero gain.
+        Directions not covered by any triangle/pair get zero gain for all
+        loudspeakers.
 
         az: azimuth angle in degrees
         el: elevation angle in degrees
         base: optional base matrix to use for gain calculation, if given, only
               the active gains will be returned
+        spread: width of the source in degrees, see calc_gains_batch
         """
         if self.is_2d and el != 0:
             raise ValueError(f"Elevation has to be zero for 2-D case, but is {el}.")
 
-        source_vec = ang_to_cart(az, el, self.is_2d)
+        if spread != 0 and base is None:
+            return self.calc_gains_batch(az, el, spread)[0]
 
-        if base is None:
-            act_idx = self.find_active_triangle(az, el)
-            base = self.ls_vec[:, act_idx]
-            gains = np.zeros(self.ls_vec.shape[1])
-        else:
-            gains = np.empty(len(source_vec))
-            act_idx = np.arange(len(source_vec))
+        source_vec = ang_to_cart(az, el, self.is_2d, dtype=self.dtype)
 
-        if base.ndim > 1:
-            act_gains = np.linalg.inv(base) @ source_vec
-        else:
-            act_gains = 1
-        gains[act_idx] = act_gains
+        if base is not None:
+            return np.linalg.inv(base) @ source_vec
+
+        gains = np.zeros(self.ls_vec.shape[1], dtype=self.dtype)
+
+        ls_idx = self._find_loudspeaker(az, el)
+        if ls_idx is not None:
+            gains[ls_idx] = 1
+            return gains
+
+        stats = self.stats
+        if stats is None:
+            tri_idx = self._lookup_triangle_index(source_vec)
+            if tri_idx >= 0:
+                gains[self.triangles[tri_idx]] = self.inv_bases[tri_idx] @ source_vec
+            return gains
+
+        t_start = time.perf_counter()
+        tri_idx = self._lookup_triangle_index(source_vec)
+        t_search = time.perf_counter()
+        if tri_idx >= 0:
+            gains[self.triangles[tri_idx]] = self.inv_bases[tri_idx] @ source_vec
+        stats.add_time("search", t_search - t_start)
+        stats.add_time("inversion", time.perf_counter() - t_search)
+        return gains
+
+    def calc_gains_batch(
+        self, az: ArrayLike, el: ArrayLike = 0, spread: float = 0
+    ) -> np.ndarray:
+        """
+        Calculate gains for many source directions at once. All triangles are
+        tested for all directions in one vectorized pass.
+
+        az: azimuth angles in degrees, array of shape (M,)
+        el: elevation angles in degrees, broadcastable to the shape of az
+        spread: width of the sources in degrees (MDAP). If nonzero, the
+                gains of a center and SPREAD_DIRECTIONS virtual sources on a
+                ring of angular diameter spread around each direction (on an
+                arc of that width for 2-D setups) are summed and normalized to
+                the mean power of the virtual sources. All virtual sources of
+                all directions are calculated in the same vectorized pass. At
+                most 360, the full circle for 2-D setups. In 3-D the ring is
+                widest at 180, wider rings lie behind the source direction
+
+        returns: gain matrix of shape (M, n_ls)
+        """
+        az, el = np.broadcast_arrays(
+            np.asarray(az, dtype=float), np.asarray(el, dtype=float)
+        )
+        az, el = az.ravel(), el.ravel()
+        if self.is_2d and np.any(el != 0):
+            raise ValueError("Elevation has to be zero for 2-D case.")
+
+        if not 0 <= spread <= 360:
+            raise ValueError(
+                f"Spread has to be between 0 and 360 degrees, but is {spread}."
+            )
 
+        if self.stats is None:
+            return self._gains_from_angles(az, el, spread)
+
+        t_start = time.perf_counter()
+        gains = self._gains_from_angles(az, el, spread)
+        self.stats.add_time("batch", time.perf_counter() - t_start)
+        self.stats.count("batch_directions", len(az))
         return gains
 
+    def _gains_from_angles(
+        self, az: np.ndarray, el: np.ndarray, spread: float
+    ) -> np.ndarray:
+        if spread == 0:
+            return self._gains_from_vecs(
+                ang_to_cart(az, el, self.is_2d, dtype=self.dtype)
+            )
+
+        # frames[:, m, j] is axis j of a frame turning the x axis to direction
+        # m: the direction itself and the directions of increasing azimuth and
+        # elevation. vecs[:, m, k] is virtual source k of direction m
+        kernel = self._spread_kernel(spread)
+        dim, n_virtual = kernel.shape
+        frames = ang_to_cart(
+            np.stack([az, az + 90, az][:dim]),
+            np.stack([el, np.zeros_like(el), el + 90][:dim]),
+            self.is_2d,
+            dtype=self.dtype,
+        ).transpose(0, 2, 1)
+        vecs = frames @ kernel
+        gains = self._gains_from_vecs(vecs.reshape(dim, -1))
+        gains = gains.reshape(len(az), n_virtual, -1)
+
+        vol_norm = np.sum(gains * gains, axis=(1, 2))[:, np.newaxis] / n_virtual
+        return _normalize_gains(gains.sum(axis=1), vol_norm)
+
+    def _spread_kernel(self, spread: float) -> np.ndarray:
+        """
+        Unit vectors of shape (dim, n_virtual) of the virtual sources of a
+        source of the given width in x direction, cached per width.
+        """
+        kernel = self._spread_kernels.get(spread)
+        if kernel is None:
+            kernel = spread_kernel(spread, self.is_2d).astype(self.dtype)
+            if len(self._spread_kernels) >= SPREAD_CACHE_SIZE:
+                # drop the oldest width
+                del self._spread_kernels[next(iter(self._spread_kernels))]
+            self._spread_kernels[spread] = kernel
+        return kernel
+
+    def _gains_from_vecs(self, source_vecs: np.ndarray) -> np.ndarray:
+        """
+        Calculate gains for source unit vectors of shape (dim, M), returns gain
+        matrix of shape (M, n_ls).
+        """
+        n_src = source_vecs.shape[1]
+        n_tri, dim, _ = self.inv_bases.shape
+        gains = np.zeros((n_src, self.ls_vec.shape[1]), dtype=self.dtype)
+
+        flat_inv_bases = self.inv_bases.reshape(-1, dim)
+        chunk = max(1, BATCH_CHUNK_SIZE // n_tri)
+        for start in range(0, n_src, chunk):
+            vecs = source_vecs[:, start : start + chunk]
+            # all_gains[t, :, m] are the gains of triangle t for source m
+            all_gains = (flat_inv_bases @ vecs).reshape(n_tri, dim, -1)
+            is_active = all_gains.min(axis=1) > -self._gain_tol
+            tri_idx = np.argmax(is_active, axis=0)
+
+            rows = np.flatnonzero(is_active[tri_idx, np.arange(len(tri_idx))])
+            tri_idx = tri_idx[rows]
+            gains[start + rows[:, None], self.triangles[tri_idx]] = all_gains[
+                tri_idx, :, rows
+            ]
+
+        return gains
+
+    def build_gain_table(self, resolution: float = 1.0) -> "GainTable":
+        """
+        Precompute gains on a regular azimuth/elevation grid, see GainTable.
+
+        resolution: grid spacing in degrees, has to divide 180
+        """
+        return GainTable.from_panner(self, resolution)
+
     def find_active_triangle(self, az: float, el: float) -> ArrayLike:
         """
-        Find active triangle by looping over all possible triangles and choosing
-        the triangle with all positive gains.
+        Find active triangle by testing all possible triangles and choosing
+        the first triangle with all positive gains.
 
         az: azimuth angle
         el: elevation angle
 
-        returns: index of active loudspeakers in the stored setup, can be integer or numpy array
+        returns: index of active loudspeakers in the stored setup, can be integer or numpy array,
+                 if no triangle is active, all indices are -1
         """
         if self.is_2d and el != 0:
             raise ValueError(f"Elevation has to be zero for 2-D case, but is {el}.")
@@ -81,18 +319,531 @@ class VbapPanner:
         # If given angles correspond to a loudspeaker position, directly reuturn
         # that index. Otherwise find active triangle/pair by calculating gains with
         # all possible triangles/pairs and choosing the one with all-positive gains
+        ls_idx = self._find_loudspeaker(az, el)
+        if ls_idx is not None:
+            return ls_idx
+
+        tri_idx = self._lookup_triangle_index(ang_to_cart(az, el, self.is_2d))
+        if tri_idx < 0:
+            return np.full(self.triangles.shape[1], -1)
+        return self.triangles[tri_idx]
+
+    def _find_loudspeaker(self, az: float, el: float) -> Optional[int]:
+        """
+        Return the index of the enabled loudspeaker placed exactly at the
+        given angles or None if there is no such loudspeaker.
+        """
+        match = np.flatnonzero((self.ls_az == az) & (self.ls_el == el))
+        if len(match) == 0 or not self.enabled[match[0]]:
+            return None
+        return int(match[0])
+
+    def _lookup_triangle_index(self, source_vec: np.ndarray) -> int:
+        """
+        Return the index of the active triangle for the given source vector
+        using the configured lookup strategy, or -1 if there is none.
+        """
+        if self.stats is not None:
+            self.stats.count("lookups")
+        if self.lookup == "walk":
+            return self._walk_triangle_index(source_vec)
+        return self._find_triangle_index(source_vec)
+
+    def _walk_triangle_index(self, source_vec: np.ndarray) -> int:
+        """
+        Find the active triangle by starting at the last active triangle and
+        repeatedly stepping to the neighbour opposite to the loudspeaker with
+        the most negative gain. Falls back to a full scan if the walk runs into
+        a degenerate triangle or does not converge.
+        """
+        vec = source_vec.tolist()
+        tri_idx = self._last_tri_idx
+        for _ in range(len(self._walk_inv_bases)):
+            if not self._walk_valid[tri_idx]:
+                break
+            gains = [
+                sum(map(operator.mul, row, vec))
+                for row in self._walk_inv_bases[tri_idx]
+            ]
+            if self.stats is not None:
+                self.stats.count("triangles_tested")
+            min_gain = min(gains)
+            if min_gain > -self._gain_tol:
+                self._last_tri_idx = tri_idx
+                return tri_idx
+            tri_idx = self._walk_neighbors[tri_idx][gains.index(min_gain)]
+
+        tri_idx = self._find_triangle_index(source_vec)
+        if tri_idx >= 0:
+            self._last_tri_idx = tri_idx
+        return tri_idx
+
+    def _find_triangle_index(self, source_vec: np.ndarray) -> int:
+        """
+        Return the index of the first triangle in self.triangles whose inverted
+        base yields all positive gains for the given source vector, or -1 if
+        there is none.
+        """
+        if self.stats is not None:
+            self.stats.count("triangles_tested", len(self.inv_bases))
+        all_gains = self.inv_bases @ source_vec
+        # comparisons with NaN (degenerate triangles) are always False
+        is_active = np.all(all_gains > -self._gain_tol, axis=1)
+        if not is_active.any():
+            return -1
+        return int(np.argmax(is_active))
+
+    def disable_speaker(self, ls_idx: int):
+        """
+        Remove a loudspeaker from the triangulation, e.g. when it failed. Only
+        the triangles around it are replaced, its gain is zero from now on.
+
+        ls_idx: index of the loudspeaker in the setup
+        """
+        if not self.enabled[ls_idx]:
+            return
+        self._check_n_enabled(np.count_nonzero(self.enabled) - 1)
+        self.enabled[ls_idx] = False
+        self._update_layout(lambda: self._remove_vertex(ls_idx))
+
+    def enable_speaker(self, ls_idx: int):
+        """
+        Add a disabled loudspeaker back to the triangulation, only the triangles
+        it can see are replaced.
+
+        ls_idx: index of the loudspeaker in the setup
+        """
+        if self.enabled[ls_idx]:
+            return
+        self.enabled[ls_idx] = True
+        self._update_layout(lambda: self._insert_vertex(ls_idx))
+
+    def move_speaker(self, ls_idx: int, az: float, el: float = 0):
+        """
+        Move a loudspeaker to a new position. If the triangles stay the same,
+        only the bases of the triangles containing the loudspeaker are
+        inverted again, otherwise the triangles around the old and the new
+        position are replaced.
+
+        ls_idx: index of the loudspeaker in the setup
+        az: new azimuth angle in degrees
+        el: new elevation angle in degrees
+        """
+        if self.is_2d and el != 0:
+            raise ValueError(f"Elevation has to be zero for 2-D case, but is {el}.")
+
+        self._make_writable()
+        old_vec = self.ls_vec[:, ls_idx].copy()
+        # copy, as the angles may be the arrays passed at object creation
+        self.ls_az = self.ls_az.copy()
+        self.ls_el = self.ls_el.copy()
+        self.ls_az[ls_idx] = az
+        self.ls_el[ls_idx] = el
+        self.ls_vec[:, ls_idx] = ang_to_cart(az, el, self.is_2d, dtype=self.dtype)
+        if not self.enabled[ls_idx]:
+            return
+
+        def move():
+            incident = np.flatnonzero(np.any(self.triangles == ls_idx, axis=1))
+            live = np.flatnonzero(self.triangles[:, 0] >= 0)
+            if self._is_hull(incident) and self._is_hull(live, [ls_idx]):
+                self.inv_bases[incident] = calc_inv_bases(
+                    self.ls_vec, self.triangles[incident]
+                )
+                self._update_walk(incident)
+                return True
+            self.enabled[ls_idx] = False
+            removed = self._remove_vertex(ls_idx, old_vec)
+            self.enabled[ls_idx] = True
+            return removed and self._insert_vertex(ls_idx)
+
+        self._update_layout(move)
+
+    def _update_layout(self, update):
+        """
+        Apply an incremental layout update and triangulate the enabled
+        loudspeakers from scratch if it fails, i.e. if the local change would
+        not give a valid convex hull.
+        """
+        self._make_writable()
+        if self.is_2d or not update():
+            # pairs of 2-D setups are so cheap to build that they are always rebuilt
+            self._rebuild()
+            if self.stats is not None:
+                self.stats.count("full_rebuilds")
+        elif self.stats is not None:
+            self.stats.count("incremental_updates")
+
+    def _check_n_enabled(self, n_enabled: int):
+        n_min = 3 if self.is_2d else 4
+        if n_enabled < n_min:
+            raise CanNotConstructConvexHull(
+                f"At least {n_min} loudspeakers have to stay enabled, but got {n_enabled}."
+            )
+
+    def _make_writable(self):
+        """
+        Copy arrays that may be shared with other panners via the layout cache
+        before changing them.
+        """
+        if not self.triangles.flags.writeable or not self.inv_bases.flags.writeable:
+            self.triangles = self.triangles.copy()
+            self.neighbors = self.neighbors.copy()
+            self.inv_bases = self.inv_bases.copy()
+
+    def _rebuild(self):
+        ls_idx = np.flatnonzero(self.enabled)
+        triangulation = triangulate(self.ls_vec[:, ls_idx])
+        self.triangles = ls_idx[triangulation.triangles]
+        self.neighbors = triangulation.neighbors.copy()
+        self.inv_bases = triangulation.inv_bases.astype(self.dtype, copy=False)
+        self._last_tri_idx = 0
+        self._init_lookup()
+
+    def _remove_vertex(self, ls_idx: int, ls_vec: Optional[np.ndarray] = None) -> bool:
+        """
+        Replace the triangles around a (disabled) loudspeaker by triangles
+        between the loudspeakers on their outer border (the link). As all
+        loudspeakers lie on the sphere, the new hull triangles are the
+        triangles of the hull of the link that are visible from the removed
+        loudspeaker. Returns False if no valid triangulation was found.
+
+        ls_vec: position of the removed loudspeaker, if it differs from the
+                one stored in self.ls_vec
+        """
+        from scipy.spatial import ConvexHull, QhullError
+
+        if ls_vec is None:
+            ls_vec = self.ls_vec[:, ls_idx]
+        incident = np.flatnonzero(np.any(self.triangles == ls_idx, axis=1))
+        link = np.unique(self.triangles[incident])
+        link = link[link != ls_idx]
+
         try:
-            active_tri = list(zip(self.ls_az, self.ls_el)).index((az, el))
-        except ValueError:
-            active_tri = np.asarray([-1, -1, -1])
-            for tri in self.triangles:
-                base = self.ls_vec[:, tri]
-                gains = self.calc_gains(az, el, base)
-                if np.min(gains) > 0:
-                    active_tri = tri
-                    break
+            # joggle, as the link is often planar, e.g. a ring around a top speaker
+            hull = ConvexHull(self.ls_vec[:, link].T, qhull_options="QJ")
+        except (QhullError, ValueError):
+            return False
+        is_visible = hull.equations[:, :-1] @ ls_vec + hull.equations[:, -1] > 0
+        new = link[hull.simplices[is_visible]]
+
+        # the new triangles have to close the hole exactly
+        if len(new) != len(link) - 2:
+            return False
+        border = _border_edges(self.triangles[incident], exclude=ls_idx)
+        if _border_edges(new) != border or not self._is_hull_triangles(new):
+            return False
+
+        self._replace_triangles(incident, new)
+        return True
+
+    def _insert_vertex(self, ls_idx: int) -> bool:
+        """
+        Replace the triangles a (new) loudspeaker can see by triangles between
+        the loudspeaker and the border of the visible area (the horizon).
+        Returns False if no valid triangulation was found.
+        """
+        live = np.flatnonzero(self.triangles[:, 0] >= 0)
+        others = self.enabled.copy()
+        others[ls_idx] = False
+        normals, offsets = _facet_planes(
+            self.ls_vec, self.triangles[live], self.ls_vec[:, others].mean(axis=1)
+        )
+        distance = normals @ self.ls_vec[:, ls_idx] - offsets
+        visible = live[distance > self._gain_tol]
+        if len(visible) == 0:
+            return False
+
+        is_visible = np.zeros(len(self.triangles), dtype=bool)
+        is_visible[visible] = True
+        new = []
+        for tri_idx in visible:
+            for k, neighbor in enumerate(self.neighbors[tri_idx]):
+                if not is_visible[neighbor]:
+                    edge = np.delete(self.triangles[tri_idx], k)
+                    new.append([edge[0], edge[1], ls_idx])
+        new = np.array(new)
+
+        if _border_edges(new, exclude=ls_idx) != _border_edges(
+            self.triangles[visible]
+        ) or not self._is_hull_triangles(new):
+            return False
+
+        self._replace_triangles(visible, new)
+        return True
+
+    def _is_hull(self, tri_idx: np.ndarray, ls_idx=None) -> bool:
+        """
+        Check that the given loudspeakers (all enabled ones if None) lie on or
+        behind the planes of the given triangles.
+        """
+        return self._is_hull_triangles(self.triangles[tri_idx], ls_idx)
+
+    def _is_hull_triangles(self, triangles: np.ndarray, ls_idx=None) -> bool:
+        interior = self.ls_vec[:, self.enabled].mean(axis=1)
+        normals, offsets = _facet_planes(self.ls_vec, triangles, interior)
+        if ls_idx is None:
+            ls_idx = np.flatnonzero(self.enabled)
+        distance = normals @ self.ls_vec[:, ls_idx] - offsets[:, np.newaxis]
+        return bool(np.all(distance <= self._gain_tol))
+
+    def _replace_triangles(self, old: np.ndarray, new: np.ndarray):
+        """
+        Put new triangles into the rows of old ones, growing the arrays if
+        needed. Unused rows stay as dead triangles: loudspeaker indices and
+        neighbours of -1 and NaN bases, so that they never become active.
+        Afterwards, the neighbours of the new triangles and the triangles
+        around them are linked again.
+        """
+        border = np.setdiff1d(self.neighbors[old].ravel(), old)
+        dead = np.setdiff1d(np.flatnonzero(self.triangles[:, 0] < 0), old)
+        rows = np.concatenate([old, dead])[: len(new)]
+
+        n_missing = len(new) - len(rows)
+        if n_missing > 0:
+            dim = self.triangles.shape[1]
+            rows = np.concatenate([rows, len(self.triangles) + np.arange(n_missing)])
+            self.triangles = np.concatenate(
+                [self.triangles, np.full((n_missing, dim), -1)]
+            )
+            self.neighbors = np.concatenate(
+                [self.neighbors, np.full((n_missing, dim), -1)]
+            )
+            self.inv_bases = np.concatenate(
+                [self.inv_bases, np.full((n_missing, dim, dim), np.nan)]
+            )
 
-        return active_tri
+        unused = np.setdiff1d(old, rows)
+        self.triangles[unused] = -1
+        self.neighbors[unused] = -1
+        self.inv_bases[unused] = np.nan
+
+        self.triangles[rows] = new
+        self.inv_bases[rows] = calc_inv_bases(self.ls_vec, new)
+        changed = np.concatenate([rows, border])
+        _link_neighbors(self.triangles, self.neighbors, changed)
+
+        if self._last_tri_idx in unused:
+            self._last_tri_idx = int(rows[0])
+        self._update_walk(np.concatenate([changed, unused]))
+
+    def _update_walk(self, tri_idx: np.ndarray):
+        """
+        Update the data of the walk lookup for the given triangles.
+        """
+        if self.lookup != "walk":
+            return
+        n_missing = len(self.triangles) - len(self._walk_inv_bases)
+        self._walk_inv_bases.extend([None] * n_missing)
+        self._walk_neighbors.extend([None] * n_missing)
+        self._walk_valid.extend([False] * n_missing)
+        for i in tri_idx.tolist():
+            self._walk_inv_bases[i] = self.inv_bases[i].tolist()
+            self._walk_neighbors[i] = self.neighbors[i].tolist()
+            self._walk_valid[i] = not np.isnan(self.inv_bases[i, 0, 0])
+
+
+class GainTable:
+    """
+    Dense table of precomputed VBAP gains on a regular grid over the sphere
+    (or the circle for 2-D setups). Gains are looked up for the nearest grid
+    point or bilinearly interpolated between the four surrounding grid points.
+
+    The table is stored as array of shape (n_el, n_az, n_ls) with azimuths
+    from -180 to 180 degrees and elevations from -90 to 90 degrees, both
+    including their end points. For 2-D setups n_el is 1.
+    """
+
+    def __init__(self, table: np.ndarray):
+        """
+        table: gain table of shape (n_el, n_az, n_ls), see class docstring
+        """
+        if table.ndim != 3 or table.shape[1] < 2:
+            raise ValueError(
+                f"Gain table has to be of shape (n_el, n_az, n_ls), but is {table.shape}."
+            )
+        self.table = table
+        self.is_2d = table.shape[0] == 1
+        self.resolution = 360 / (table.shape[1] - 1)
+
+        if not self.is_2d and table.shape[0] != (table.shape[1] - 1) // 2 + 1:
+            raise ValueError(
+                f"Azimuth and elevation resolution of gain table with shape {table.shape} differ."
+            )
+
+    @classmethod
+    def from_panner(cls, panner: VbapPanner, resolution: float = 1.0) -> "GainTable":
+        """
+        Build a gain table from the exact gains of the given panner.
+
+        panner: panner to take loudspeaker setup and gains from
+        resolution: grid spacing in degrees, has to divide 180
+        """
+        n_steps = 180 / resolution
+        if resolution <= 0 or abs(n_steps - round(n_steps)) > 1e-9:
+            raise ValueError(f"Resolution has to divide 180, but is {resolution}.")
+        n_steps = round(n_steps)
+
+        az = np.linspace(-180, 180, 2 * n_steps + 1)
+        el = np.zeros(1) if panner.is_2d else np.linspace(-90, 90, n_steps + 1)
+        el_grid, az_grid = np.meshgrid(el, az, indexing="ij")
+
+        gains = panner.calc_gains_batch(az_grid.ravel(), el_grid.ravel())
+        return cls(gains.reshape(len(el), len(az), -1))
+
+    @classmethod
+    def load(cls, filename: str, mmap: bool = True) -> "GainTable":
+        """
+        Load a gain table saved with GainTable.save.
+
+        filename: path to .npy file
+        mmap: if true, the table is memory-mapped read-only instead of read into memory
+        """
+        return cls(np.load(filename, mmap_mode="r" if mmap else None))
+
+    def save(self, filename: str):
+        """
+        Save the gain table to a .npy file.
+        """
+        np.save(filename, self.table)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory footprint of the table in bytes.
+        """
+        return self.table.nbytes
+
+    def lookup(
+        self, az: ArrayLike, el: ArrayLike = 0, interpolate: bool = True
+    ) -> np.ndarray:
+        """
+        Look up gains for one or many source directions.
+
+        az: azimuth angle(s) in degrees
+        el: elevation angle(s) in degrees
+        interpolate: if true, gains are bilinearly interpolated between the
+                     surrounding grid points and re-normalized to the
+                     interpolated power of these grid points, otherwise the
+                     gains of the nearest grid point are returned
+
+        returns: gains of shape (n_ls,) for scalar angles, (M, n_ls) otherwise
+        """
+        if np.ndim(az) == 0 and np.ndim(el) == 0:
+            return self._lookup_single(float(az), float(el), interpolate)
+
+        az, el = np.broadcast_arrays(
+            np.asarray(az, dtype=float), np.asarray(el, dtype=float)
+        )
+        az, el = az.ravel(), el.ravel()
+        if self.is_2d and np.any(el != 0):
+            raise ValueError("Elevation has to be zero for 2-D case.")
+
+        # fractional grid positions
+        az_pos = ((az + 180) % 360) / self.resolution
+        el_pos = np.clip(el + 90, 0, 180) / self.resolution
+
+        if not interpolate:
+            el_idx = 0 if self.is_2d else np.rint(el_pos).astype(int)
+            return self.table[el_idx, np.rint(az_pos).astype(int)]
+
+        az_idx, az_frac = _grid_index(az_pos, self.table.shape[1])
+        if self.is_2d:
+            corners = self.table[0, [az_idx, az_idx + 1]]
+            weights = np.stack([1 - az_frac, az_frac]).astype(self.table.dtype)
+        else:
+            el_idx, el_frac = _grid_index(el_pos, self.table.shape[0])
+            corners = self.table[
+                [el_idx, el_idx, el_idx + 1, el_idx + 1],
+                [az_idx, az_idx + 1, az_idx, az_idx + 1],
+            ]
+            weights = np.stack(
+                [
+                    (1 - el_frac) * (1 - az_frac),
+                    (1 - el_frac) * az_frac,
+                    el_frac * (1 - az_frac),
+                    el_frac * az_frac,
+                ]
+            ).astype(self.table.dtype)
+        weights = weights[..., np.newaxis]
+        vol_norm = np.sum(weights * np.sum(corners**2, axis=-1, keepdims=True), 0)
+        return _normalize_gains(np.sum(weights * corners, 0), vol_norm)
+
+    def _lookup_single(self, az: float, el: float, interpolate: bool) -> np.ndarray:
+        """
+        Look up gains for a single source direction, avoids the overhead of
+        the vectorized lookup for real-time use.
+        """
+        if self.is_2d and el != 0:
+            raise ValueError(f"Elevation has to be zero for 2-D case, but is {el}.")
+
+        az_pos = ((az + 180) % 360) / self.resolution
+        el_pos = min(max(el + 90, 0), 180) / self.resolution
+
+        if not interpolate:
+            el_idx = 0 if self.is_2d else round(el_pos)
+            return self.table[el_idx, round(az_pos)].copy()
+
+        az_idx = min(int(az_pos), self.table.shape[1] - 2)
+        az_frac = az_pos - az_idx
+        if self.is_2d:
+            corners = self.table[0, az_idx : az_idx + 2]
+            weights = np.array([1 - az_frac, az_frac], dtype=self.table.dtype)
+        else:
+            el_idx = min(int(el_pos), self.table.shape[0] - 2)
+            el_frac = el_pos - el_idx
+            corners = self.table[el_idx : el_idx + 2, az_idx : az_idx + 2].reshape(
+                4, -1
+            )
+            weights = np.array(
+                [
+                    (1 - el_frac) * (1 - az_frac),
+                    (1 - el_frac) * az_frac,
+                    el_frac * (1 - az_frac),
+                    el_frac * az_frac,
+                ],
+                dtype=self.table.dtype,
+            )
+        vol_norm = weights @ np.sum(corners**2, axis=1)
+        return _normalize_gains(weights @ corners, vol_norm)
+
+    def max_error(
+        self, panner: VbapPanner, n_dirs: int = 10000, interpolate: bool = True
+    ) -> float:
+        """
+        Maximum absolute gain deviation of table lookups from the exact gains
+        of the given panner for random source directions. Note that this
+        includes the gain jumps at the border of the area covered by the
+        loudspeaker setup (e.g. at the horizon of a dome).
+
+        panner: panner the table was built from
+        n_dirs: number of random, uniformly distributed directions to test
+        interpolate: passed on to lookup
+        """
+        rng = np.random.default_rng(0)
+        az = rng.uniform(-180, 180, n_dirs)
+        if self.is_2d:
+            el = np.zeros(n_dirs)
+        else:
+            el = np.arcsin(rng.uniform(-1, 1, n_dirs)) / DEG_2_RAD
+
+        exact = panner.calc_gains_batch(az, el)
+        return float(np.max(np.abs(self.lookup(az, el, interpolate) - exact)))
+
+    def __repr__(self) -> str:
+        return (
+            f"GainTable(resolution={self.resolution:g}, n_ls={self.table.shape[2]}, "
+            f"size={self.nbytes / 2**20:.1f} MiB)"
+        )
+
+
+def _grid_index(pos: np.ndarray, n_grid: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split fractional grid positions into the index of the lower grid point and
+    the fraction towards the upper one, keeping both grid points in range.
+    """
+    idx = np.minimum(np.floor(pos).astype(int), n_grid - 2)
+    return idx, pos - idx
 
 
 def ang_to_cart(
@@ -100,6 +851,7 @@ def ang_to_cart(
     el: Union[float, np.ndarray] = 0,
     is_2d: bool = False,
     unit: str = "DEG",
+    dtype: type = np.float64,
 ) -> np.ndarray:
     """
     Calculate unit vector for given azimuth and elevation angles.
@@ -108,6 +860,7 @@ def ang_to_cart(
     el: elevation angle
     is_2d: flag, if true, result is returned as 2-D vector
     unit: either "DEG" or "RAD", indicates how to interpret angle values
+    dtype: data type of the result, angles are converted in float64
     """
     azi = np.asarray(az, dtype=float).copy()
     ele = np.asarray(el, dtype=float).copy()
@@ -127,14 +880,178 @@ def ang_to_cart(
         z = np.sin(ele)
         result = np.asarray([x, y, z])
 
-    return result
+    return result.astype(dtype, copy=False)
+
+
+def spread_kernel(
+    spread: float, is_2d: bool = False, n_dirs: int = SPREAD_DIRECTIONS
+) -> np.ndarray:
+    """
+    Unit vectors of the virtual sources of a source of the given width in x
+    direction: the x axis itself and n_dirs directions evenly distributed on
+    a ring of angular diameter spread around it, or on an arc of width spread
+    for 2-D setups.
+
+    spread: width of the source in degrees, at most 360
+    returns: array of shape (dim, n_dirs + 1)
+    """
+    radius = spread / 2 * DEG_2_RAD
+    if is_2d:
+        # both ends of a full circle are the same direction, so only one is used
+        full = spread >= 360
+        angles = np.linspace(-radius, radius, n_dirs + 1, endpoint=not full)
+        return np.stack([np.cos(angles), np.sin(angles)])
+
+    phi = np.arange(n_dirs) * 2 * np.pi / n_dirs
+    ring = np.stack(
+        [
+            np.full(n_dirs, np.cos(radius)),
+            np.sin(radius) * np.cos(phi),
+            np.sin(radius) * np.sin(phi),
+        ]
+    )
+    return np.concatenate([[[1], [0], [0]], ring], axis=1)
+
+
+def triangulate(ls_vec: np.ndarray) -> Triangulation:
+    """
+    Construct the convex hull of the loudspeaker setup and invert the bases of
+    all its triangles/pairs.
+
+    ls_vec: loudspeaker unit vectors of shape (dim, n_ls)
+    """
+    if ls_vec.shape[0] == 2:
+        triangles, neighbors = _calc_pairs(ls_vec)
+    else:
+        triangles, neighbors = _calc_hull_triangles(ls_vec)
+
+    return Triangulation(triangles, neighbors, calc_inv_bases(ls_vec, triangles))
+
+
+def _calc_pairs(ls_vec: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Form loudspeaker pairs for a 2-D setup by connecting loudspeakers that are
+    adjacent in azimuth. As all loudspeakers lie on the unit circle, this gives
+    the same pairs as the convex hull.
+
+    returns: pairs of shape (n_ls, 2) and their neighbours, see VbapPanner.neighbors
+    """
+    n_ls = ls_vec.shape[1]
+    if n_ls < 3:
+        raise CanNotConstructConvexHull(
+            f"At least 3 loudspeakers are needed for a 2-D setup, but got {n_ls}."
+        )
+
+    order = np.argsort(np.arctan2(ls_vec[1], ls_vec[0]))
+    pairs = np.stack([order, np.roll(order, -1)], axis=1)
+    # pair i shares its second loudspeaker with pair i + 1 and its first
+    # loudspeaker with pair i - 1
+    idx = np.arange(n_ls)
+    neighbors = np.stack([np.roll(idx, -1), np.roll(idx, 1)], axis=1)
+
+    return pairs, neighbors
+
+
+def _calc_hull_triangles(ls_vec: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Construct the convex hull of a 3-D setup.
+
+    returns: triangles of shape (n_tri, 3) and their neighbours, see VbapPanner.neighbors
+    """
+    # SciPy is imported here, as importing it takes longer than everything else
+    # and it is neither needed for 2-D setups nor for cached setups
+    from scipy.spatial import ConvexHull, QhullError
+
+    try:
+        hull = ConvexHull(ls_vec.T)
+    except QhullError:
+        raise CanNotConstructConvexHull(
+            "Error at complex hull construction. Your loudspeaker setup might be invalid!"
+        )
+
+    return hull.simplices, hull.neighbors
+
+
+def _facet_planes(
+    ls_vec: np.ndarray, triangles: np.ndarray, interior: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Planes of triangles as unit normals of shape (n_tri, 3) pointing away from
+    the given interior point and offsets along the normals.
+    """
+    corners = ls_vec[:, triangles]
+    normals = np.cross(
+        corners[:, :, 1] - corners[:, :, 0], corners[:, :, 2] - corners[:, :, 0], axis=0
+    ).T
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    offsets = np.einsum("ij,ji->i", normals, corners[:, :, 0])
+    normals *= np.where(normals @ interior > offsets, -1, 1)[:, np.newaxis]
+    return normals, np.einsum("ij,ji->i", normals, corners[:, :, 0])
+
+
+def _border_edges(triangles: np.ndarray, exclude: Optional[int] = None) -> set:
+    """
+    Edges that belong to only one of the given triangles, i.e. the border of
+    the area covered by them, ignoring edges with the loudspeaker exclude.
+    """
+    counts = {}
+    for tri in triangles.tolist():
+        for k in range(3):
+            edge = tuple(sorted(tri[:k] + tri[k + 1 :]))
+            counts[edge] = counts.get(edge, 0) + 1
+    return {edge for edge, n in counts.items() if n == 1 and exclude not in edge}
+
+
+def _link_neighbors(triangles: np.ndarray, neighbors: np.ndarray, tri_idx: np.ndarray):
+    """
+    Update neighbors (see VbapPanner.neighbors) of the given triangles in
+    place, wherever two of them share an edge.
+    """
+    edges = {}
+    for i in tri_idx.tolist():
+        tri = triangles[i].tolist()
+        for k in range(len(tri)):
+            edges.setdefault(tuple(sorted(tri[:k] + tri[k + 1 :])), []).append((i, k))
+    for shared in edges.values():
+        if len(shared) == 2:
+            (i, k), (j, l) = shared
+            neighbors[i, k] = j
+            neighbors[j, l] = i
+
+
+def calc_inv_bases(ls_vec: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """
+    Invert the base matrices of all loudspeaker triangles/pairs at once.
+
+    ls_vec: loudspeaker unit vectors of shape (dim, n_ls)
+    triangles: loudspeaker indices of all triangles/pairs, shape (n_tri, dim)
+
+    returns: inverted bases of shape (n_tri, dim, dim) and the data type of
+             ls_vec, degenerate bases are filled with NaN so that they never
+             become active. Bases are always inverted in float64.
+    """
+    # bases[i] has the loudspeaker vectors of triangle i as columns
+    bases = np.ascontiguousarray(ls_vec[:, triangles].transpose(1, 0, 2), dtype=float)
+    inv_bases = np.full(bases.shape, np.nan)
+
+    valid = np.abs(np.linalg.det(bases)) > DET_TOL
+    inv_bases[valid] = np.linalg.inv(bases[valid])
+
+    return inv_bases.astype(ls_vec.dtype, copy=False)
 
 
 def _normalize_gains(gains, vol_norm):
     """
-    Normalize gain factors to garantue power conservation.
+    Normalize gain factors to garantue power conservation. Gains can be a
+    single gain vector or a matrix with one gain vector per row, all-zero gain
+    vectors stay zero.
     """
-    return gains * np.sqrt(vol_norm / np.sum(gains**2))
+    if gains.ndim == 1:
+        power = gains @ gains
+        return gains * np.sqrt(vol_norm / power) if power > 0 else np.zeros_like(gains)
+
+    power = np.sum(gains * gains, axis=-1, keepdims=True)
+    return gains * np.sqrt(vol_norm / np.where(power > 0, power, np.inf))
 
 
 class CanNotConstructConvexHull(Exception):
@@ -1,50 +1,148 @@
-from pyvbap import VbapPanner
+from pyvbap import VbapPanner, Stats, DelayLine, speaker_compensation
 import soundfile as sf
-import sounddevice as sd
 import numpy as np
+from threading import Thread, Event, Lock
+from typing import NamedTuple
+import time
 
 class VbapPlayer():
+    """
+    Plays any number of mono sound files (sources) in an endless loop, each panned to its own
+    position. The source opened with open_file has the id 0 and is moved with set_position,
+    further sources are added with add_source.
 
-    def __init__(self, ls_az, ls_el, filename=None, bufsize=1024):
+    backend: callable creating the output stream from the keyword arguments channels,
+        callback, blocksize and samplerate. Defaults to a sounddevice OutputStream, use
+        OfflineStream to render without a sound card.
+    stats: if true, callback durations, gain recomputations, underruns, file reads and the
+        panner's lookups are recorded in self.stats, a Stats instance can be passed as well.
+    dtype: data type sources are read, panned and mixed in. Defaults to float32, the sample
+        format of the output stream, use float64 for exact gains.
+    ls_radius, ls_trim, ls_delay: optional distance of each loudspeaker in m, trim gain in
+        dB and delay in ms, see pyvbap.speaker_compensation. Trims are applied with the
+        panning gains, delays by a delay line on the output of the callback.
+    """
+
+    def __init__(self, ls_az, ls_el, filename=None, bufsize=1024, prefetch_blocks=16, backend=None, samplerate=None, stats=False, dtype=np.float32, ls_radius=None, ls_trim=None, ls_delay=None):
 
         self.az = 0
         self.el = 0
         self.is_playing = False
-        self._sf = None
+        # number of source blocks that were not prefetched in time and played as silence
+        self.underruns = 0
 
         self.filename = filename
         self.bufsize = bufsize
+        self.prefetch_blocks = prefetch_blocks
+        self.dtype = np.dtype(dtype)
+
+        self.stats = Stats() if stats is True else (stats or None)
+        self._panner = VbapPanner(ls_az, ls_el, cache=True, stats=self.stats or False, dtype=self.dtype)
+        # sources by id and the prefetch reader in each row (slot) of the mix, only accessed
+        # from control threads while holding self._lock. The audio callback only sees
+        # self._mix, which is replaced as a whole whenever sources or positions change
+        self._sources = dict()
+        self._slots = []
+        self._next_id = 1
+        self._lock = Lock()
+        self._mix = _MixState((), np.zeros((0, len(ls_az)), self.dtype), np.zeros((0, self.bufsize), self.dtype), np.zeros((0, len(ls_az)), self.dtype))
+
+        # owned by the audio callback: the mix state it played last, the gains it played
+        # and buffers for crossfading to new gains within one block
+        self._played_mix = self._mix
+        self._played_gains = self._mix.played_gains
+        self._fade_buf = np.zeros((self.bufsize, len(ls_az)), self.dtype)
+        self._fade_ramp = (np.arange(1, self.bufsize + 1, dtype=self.dtype) / self.bufsize)[:, np.newaxis]
 
-        self._panner = VbapPanner(ls_az, ls_el)
-        self._stream = sd.OutputStream(channels=len(ls_az), callback=self._audio_callback, blocksize=self.bufsize)
+        # one thread reads ahead for all sources
+        self._prefetch = PrefetchThread(self.stats)
+        self._prefetch.start()
+        if backend is None:
+            backend = sounddevice_stream
+        self._stream = backend(channels=len(ls_az), callback=self._audio_callback, blocksize=self.bufsize, samplerate=samplerate)
+        self.samplerate = self._stream.samplerate
+
+        # distance compensation, None if not needed
+        self._trim = None
+        self._delay_line = None
+        compensation = speaker_compensation(len(ls_az), self.samplerate, ls_radius, ls_trim, ls_delay)
+        if compensation is not None:
+            trim, delays = compensation
+            if np.any(trim != 1):
+                self._trim = trim.astype(self.dtype)
+            if np.any(delays > 0):
+                self._delay_line = DelayLine(delays, self.bufsize, self.dtype)
 
         if self.filename is not None:
             self.open_file(filename)
 
     def __del__(self):
-        if self._sf is not None:
-            self._sf.close()
         if self.is_playing:
             self.stop()
+        for source_id in list(self._sources):
+            self.remove_source(source_id)
+        self._prefetch.stop()
 
     def open_file(self, filename):
 
         if self.is_playing:
             self.stop()
 
-        if self._sf is not None:
-            self._sf.close()
-            self._sf = None
+        if 0 in self._sources:
+            self.remove_source(0)
+
+        self._add_source(0, filename, self.az, self.el)
+
+    def add_source(self, filename, azimuth=0, elevation=0):
+        """
+        Add another mono sound file to the mix, returns the id of the new source.
+        """
+        with self._lock:
+            source_id = self._next_id
+            self._next_id += 1
+        self._add_source(source_id, filename, azimuth, elevation)
+        return source_id
+
+    def _add_source(self, source_id, filename, azimuth, elevation):
+        # nothing is opened or changed for positions the panner can't handle
+        self._check_position(azimuth, elevation)
+        f = sf.SoundFile(filename)
+
+        try:
+            if not f.channels == 1:
+                raise ValueError(f"SoundFile has to be mono, but has {f.channels} channels.")
+
+            reader = PrefetchReader(f, self.bufsize, self.prefetch_blocks, self.dtype)
+            # fill the buffer right away, so that the source is ready when it joins the mix
+            reader.fill()
+        except Exception:
+            f.close()
+            raise
 
-        tmp = sf.SoundFile(filename)
+        with self._lock:
+            # reuse the first free slot, the callback fades the new source in from zero
+            # gains even if it never played the slot as free, see _render
+            slot = self._slots.index(None) if None in self._slots else len(self._slots)
+            if slot == len(self._slots):
+                self._slots.append(None)
+            self._slots[slot] = reader
+            self._sources[source_id] = _Source(f, reader, slot, azimuth, elevation)
+            self._update_mix()
 
-        if not tmp.channels == 1:
-            raise ValueError(f"SoundFile has to be mono, but has {tmp.channels} channels.")
+    def has_source(self, source_id):
+        return source_id in self._sources
 
-        self._sf = tmp
+    def remove_source(self, source_id):
+        with self._lock:
+            source = self._sources.pop(source_id)
+            self._slots[source.slot] = None
+            self._update_mix()
+        # wait until the prefetch thread is done with the source before closing the file
+        with self._prefetch.lock:
+            source.file.close()
 
     def play(self):
-        if self._sf is not None and not self.is_playing:
+        if len(self._sources) > 0 and not self.is_playing:
             self.is_playing = True
             self._stream.start()
 
@@ -53,20 +151,404 @@ class VbapPlayer():
             self.is_playing = False
             self._stream.stop()
 
-    def _audio_callback(self, outdata, frames, time, status):
-        buf = self._sf.read(self.bufsize)
-        if len(buf) < self.bufsize:
-            self._sf.seek(0)
-            buf = np.concatenate([buf, self._sf.read(self.bufsize - len(buf))])
+    def _audio_callback(self, outdata, frames, time_info, status):
+        if self.stats is None:
+            self._render(outdata, frames)
+            return
+
+        t_start = time.perf_counter()
+        self._render(outdata, frames)
+        self.stats.add_time("callback", time.perf_counter() - t_start)
+
+    def _render(self, outdata, frames):
+        mix = self._mix
+        readers, gains, inbuf, played_gains = mix
+        n_slots = len(readers)
+
+        if played_gains is not self._played_gains:
+            # the buffers grew, carry over the gains played so far
+            np.copyto(played_gains[:len(self._played_gains)], self._played_gains)
+            self._played_gains = played_gains
 
-        gains = self._panner.calc_gains(self.az, self.el)
-        out = buf.reshape((-1, 1)) * gains
+        if mix is not self._played_mix:
+            # a slot that got a new source since the last played mix starts from zero
+            # gains, not from the gains of the source that had the slot before
+            played_readers = self._played_mix.readers
+            for slot in range(min(n_slots, len(played_readers))):
+                if readers[slot] is not None and readers[slot] is not played_readers[slot]:
+                    played_gains[slot].fill(0)
 
-        outdata[:] = out
+        # only consume prefetched blocks, the audio thread never waits for file I/O
+        for reader, buf in zip(readers, inbuf):
+            if reader is None:
+                buf.fill(0)
+            elif not reader.read_block(buf):
+                self.underruns += 1
+                if self.stats is not None:
+                    self.stats.count("underruns")
+                buf.fill(0)
+        self._prefetch.wakeup()
+
+        # mix all sources with one matrix product, writing directly to the output buffer
+        x = inbuf[:n_slots, :frames].T
+        np.matmul(x, played_gains[:n_slots], out=outdata)
+
+        if mix is not self._played_mix:
+            # gains changed, crossfade linearly from the old to the new mix within this block:
+            # out = y_old + ramp * (y_new - y_old)
+            y_new = self._fade_buf[:frames]
+            np.matmul(x, gains, out=y_new)
+            np.subtract(y_new, outdata, out=y_new)
+            np.multiply(y_new, self._fade_ramp[:frames], out=y_new)
+            np.add(outdata, y_new, out=outdata)
+            np.copyto(played_gains[:n_slots], gains)
+            self._played_mix = mix
+
+        if self._delay_line is not None:
+            self._delay_line.process(outdata, outdata)
 
     def set_position(self, azimuth, elevation):
-        self.az = azimuth
-        self.el = elevation
+        self._check_position(azimuth, elevation)
+        if (azimuth, elevation) != (self.az, self.el):
+            if 0 in self._sources:
+                self.set_positions([0], [azimuth], [elevation])
+            else:
+                self.az = azimuth
+                self.el = elevation
+
+    def set_source_position(self, source_id, azimuth, elevation):
+        self._check_position(azimuth, elevation)
+        if self.set_positions([source_id], [azimuth], [elevation]):
+            raise KeyError(source_id)
+
+    def set_positions(self, source_ids, azimuths, elevations):
+        """
+        Move several sources at once, gains of all sources are recalculated in one batch.
+        Can be called from any thread, the audio callback crossfades to the new gains
+        within its next block. Sources that don't exist, e.g. because they were removed
+        in the meantime, and positions the panner can't handle, see _check_position, are
+        skipped, the other sources are still moved. Returns the list of skipped ids.
+        """
+        skipped = []
+        with self._lock:
+            for source_id, az, el in zip(source_ids, azimuths, elevations):
+                source = self._sources.get(source_id)
+                try:
+                    self._check_position(az, el)
+                except (ValueError, TypeError):
+                    source = None
+                if source is None:
+                    skipped.append(source_id)
+                    continue
+                source.az = az
+                source.el = el
+                if source_id == 0:
+                    self.az = az
+                    self.el = el
+            self._update_mix()
+        return skipped
+
+    def _check_position(self, azimuth, elevation):
+        """
+        Raise a ValueError for a position the panner can't calculate gains for. Positions
+        are checked before they are stored, so a bad one never breaks the mix.
+        """
+        if not (np.isfinite(azimuth) and np.isfinite(elevation)):
+            raise ValueError(f"Position has to be finite, but is ({azimuth}, {elevation}).")
+        if self._panner.is_2d and elevation != 0:
+            raise ValueError(f"Elevation has to be zero for 2-D case, but is {elevation}.")
+
+    def source_gains(self, source_id=0):
+        """
+        Gains the audio callback plays or fades to for a source, None if there is no such
+        source. Only reads the control state, e.g. for meters, and never waits for the
+        audio thread.
+        """
+        with self._lock:
+            source = self._sources.get(source_id)
+            if source is None:
+                return None
+            return self._mix.gains[source.slot].copy()
+
+    def disable_speaker(self, ls_idx):
+        """
+        Stop using a loudspeaker, e.g. when it failed. Sources are panned to the remaining
+        loudspeakers from the next block on, see VbapPanner.disable_speaker.
+        """
+        with self._lock:
+            self._panner.disable_speaker(ls_idx)
+            self._update_mix()
+
+    def enable_speaker(self, ls_idx):
+        with self._lock:
+            self._panner.enable_speaker(ls_idx)
+            self._update_mix()
+
+    def move_speaker(self, ls_idx, azimuth, elevation):
+        with self._lock:
+            self._panner.move_speaker(ls_idx, azimuth, elevation)
+            self._update_mix()
+
+    def _update_mix(self):
+        # gains are only calculated when sources or positions change, never in the audio
+        # callback. Each source keeps its slot, so rows of old and new gains match and
+        # free slots fade to zero
+        if self.stats is not None:
+            self.stats.count("gain_updates")
+        sources = list(self._sources.values())
+        gains = np.zeros((len(self._slots), len(self._panner.ls_az)), self.dtype)
+        if len(sources) > 0:
+            gains[[s.slot for s in sources]] = self._panner.calc_gains_batch(
+                [s.az for s in sources], [s.el for s in sources]
+            )
+            if self._trim is not None:
+                gains *= self._trim
+
+        _, _, inbuf, played_gains = self._mix
+        if len(inbuf) < len(self._slots):
+            inbuf = np.zeros((2 * len(self._slots), self.bufsize), self.dtype)
+            played_gains = np.zeros((len(inbuf), len(self._panner.ls_az)), self.dtype)
+
+        readers = tuple(self._slots)
+        # swapping the reference is atomic, the callback sees either the old or the new mix
+        self._mix = _MixState(readers, gains, inbuf, played_gains)
+        self._prefetch.readers = tuple(s.reader for s in sources)
+
+
+class _Source():
+
+    def __init__(self, file, reader, slot, az, el):
+        self.file = file
+        self.reader = reader
+        self.slot = slot
+        self.az = az
+        self.el = el
+
+
+class _MixState(NamedTuple):
+    # prefetch reader of each slot (None for free slots), target gains of shape
+    # (n_slots, n_ls), a preallocated input buffer with at least one row of bufsize frames
+    # per slot and the gains last played by the callback, with at least one row per slot
+    readers: tuple
+    gains: np.ndarray
+    inbuf: np.ndarray
+    played_gains: np.ndarray
+
+
+class PrefetchReader():
+    """
+    Reads a mono sound file in an endless loop into a ring of preallocated blocks. There is
+    exactly one producer (the prefetch thread) and one consumer (the audio callback), each only
+    advancing its own counter, so no locks are needed.
+    """
+
+    def __init__(self, soundfile, blocksize, n_blocks=16, dtype=np.float64):
+        self._sf = soundfile
+        self._blocks = np.zeros((n_blocks, blocksize), dtype)
+        # total number of blocks written by the producer and read by the consumer
+        self._n_written = 0
+        self._n_read = 0
+
+    def read_block(self, out):
+        """
+        Copy the oldest prefetched block to out, returns False if no block is available.
+        """
+        if self._n_read == self._n_written:
+            return False
+        np.copyto(out, self._blocks[self._n_read % len(self._blocks)])
+        self._n_read += 1
+        return True
+
+    def fill(self):
+        """
+        Read blocks until the ring is full. Consecutive free blocks are read at once, as the
+        overhead of a read call is much higher than the cost per frame.
+        """
+        n_blocks = len(self._blocks)
+        while (n_free := n_blocks - (self._n_written - self._n_read)) > 0:
+            start = self._n_written % n_blocks
+            n = min(n_free, n_blocks - start)
+            self._read_from_file(self._blocks[start:start + n].reshape(-1))
+            # only publish blocks once they are completely written
+            self._n_written += n
+
+    def _read_from_file(self, buf):
+        n_read = len(self._sf.read(out=buf))
+        while n_read < len(buf):
+            # loop file
+            self._sf.seek(0)
+            n = len(self._sf.read(out=buf[n_read:]))
+            if n == 0:
+                buf[n_read:] = 0
+                break
+            n_read += n
+
+
+class PrefetchThread():
+    """
+    Background thread that refills the rings of a set of prefetch readers whenever it is woken up.
+    """
+
+    def __init__(self, stats=None):
+        # replaced as a whole when readers are added or removed
+        self.readers = ()
+        self.stats = stats
+        # held while readers are filled, so that files are not closed in the middle of a read
+        self.lock = Lock()
+        self._wakeup = Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.clear()
+            t_start = time.perf_counter()
+            with self.lock:
+                for reader in self.readers:
+                    reader.fill()
+            if self.stats is not None:
+                self.stats.add_time("file_reads", time.perf_counter() - t_start)
+            self._wakeup.wait()
+
+
+def sounddevice_stream(**kwargs):
+    """
+    Default backend, an output stream on the default sound card. sounddevice is only
+    imported here, so that the player can be used without it.
+    """
+    import sounddevice as sd
+    return sd.OutputStream(**kwargs)
+
+
+class OfflineStream():
+    """
+    Output stream that calls the audio callback without a sound card, either as fast as
+    possible or paced at the rate a sound card would call it (realtime=True). Rendered
+    blocks are passed to sink.write, e.g. a MemorySink or an open soundfile.SoundFile,
+    and dropped if there is no sink. The duration of every callback is recorded, see stats.
+
+    Can be passed to VbapPlayer as backend directly, or with functools.partial to set
+    realtime, sink or max_blocks.
+    """
+
+    def __init__(self, channels, callback, blocksize, samplerate=None, dtype='float32', realtime=False, sink=None, max_blocks=100000):
+        """
+        max_blocks: number of callback times kept, older times are overwritten
+        """
+        self.channels = channels
+        self.blocksize = blocksize
+        self.samplerate = 48000 if samplerate is None else samplerate
+        self.realtime = realtime
+        self.sink = sink
+        self.active = False
+
+        self._callback = callback
+        self._outdata = np.zeros((blocksize, channels), dtype=dtype)
+        self._times = np.zeros(max_blocks)
+        self._n_blocks = 0
+        self._thread = None
+
+    def start(self):
+        """
+        Call the callback in a background thread until stop is called.
+        """
+        self.active = True
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.active = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+
+    def run(self, n_blocks=None):
+        """
+        Call the callback n_blocks times in the calling thread, or until stop is called if
+        n_blocks is None. Returns the stats of all blocks rendered so far.
+        """
+        budget = self.blocksize / self.samplerate
+        deadline = time.perf_counter()
+        i = 0
+        while (n_blocks is None and self.active) or (n_blocks is not None and i < n_blocks):
+            t_start = time.perf_counter()
+            self._callback(self._outdata, self.blocksize, None, None)
+            self._times[self._n_blocks % len(self._times)] = time.perf_counter() - t_start
+            self._n_blocks += 1
+            i += 1
+
+            if self.sink is not None:
+                self.sink.write(self._outdata)
+
+            if self.realtime:
+                deadline += budget
+                time.sleep(max(0, deadline - time.perf_counter()))
+
+        return self.stats()
+
+    def stats(self):
+        """
+        Callback times in seconds (mean, median, 90th and 99th percentile, max) and the number
+        of deadline misses, i.e. callbacks that took longer than one block lasts.
+        """
+        budget = self.blocksize / self.samplerate
+        times = self._times[:min(self._n_blocks, len(self._times))]
+        if len(times) == 0:
+            times = np.zeros(1)
+        p50, p90, p99 = np.percentile(times, [50, 90, 99])
+        return {
+            'blocks': self._n_blocks,
+            'blocksize': self.blocksize,
+            'budget': budget,
+            'mean': times.mean(),
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'max': times.max(),
+            'deadline_misses': int(np.count_nonzero(times > budget)),
+        }
+
+
+class MemorySink():
+    """
+    Keeps the last n_frames frames written by an OfflineStream in a preallocated buffer.
+    """
+
+    def __init__(self, n_frames, channels):
+        self.buffer = np.zeros((n_frames, channels), dtype=np.float32)
+        self.n_written = 0
+
+    def write(self, block):
+        n_frames = len(self.buffer)
+        start = self.n_written % n_frames
+        n = min(len(block), n_frames - start)
+        self.buffer[start:start + n] = block[:n]
+        self.buffer[:len(block) - n] = block[n:]
+        self.n_written += len(block)
+
+    def data(self):
+        """
+        Frames written so far in the order they were written, at most n_frames.
+        """
+        if self.n_written <= len(self.buffer):
+            return self.buffer[:self.n_written]
+        return np.roll(self.buffer, -(self.n_written % len(self.buffer)), axis=0)
 
 
 class CanNotOpenWavFile(Exception):